@@ -174,11 +174,9 @@ export default function ChatPage() {
           fullResponse += data.content
           onChunk(data.content)
         } else if (data.type === 'complete') {
-          // The complete message contains the full response and citations
-          fullResponse = data.content
+          // The complete message carries citations; the text was already streamed
           citations = data.citations || []
           messageId = data.message_id
-          onChunk(data.content)
 
           // Update current session ID if this is a new session
           if (!currentSessionId) {
@@ -8,6 +8,12 @@ import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs'
 import { apiService } from '@/lib/api'
 
+// Processing runs in the background; poll its status until it finishes
+const PROCESS_POLL_INTERVAL_MS = 1000
+const PROCESS_POLL_TIMEOUT_MS = 5 * 60 * 1000
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms))
+
 interface Document {
   id: number
   filename: string
@@ -47,14 +53,39 @@ export default function DocumentsPage() {
     }
   }
 
+  const waitForProcessing = async (documentId: number) => {
+    const deadline = Date.now() + PROCESS_POLL_TIMEOUT_MS
+    while (Date.now() < deadline) {
+      await sleep(PROCESS_POLL_INTERVAL_MS)
+      const status = await apiService.getDocumentProcessStatus(documentId)
+      if (!status.success || !status.data) {
+        throw new Error(status.error || 'Failed to get processing status')
+      }
+      if (status.data.status === 'processed') {
+        return
+      }
+      if (status.data.status === 'failed') {
+        throw new Error(status.data.error || 'Processing failed')
+      }
+    }
+    // Still queued; the list shows it as unprocessed until the next refresh
+  }
+
   const handleFileProcess = async (documentId: number) => {
     const response = await apiService.processDocument(documentId)
-    if (response.success) {
-      await loadDocuments() // Reload documents list
-    } else {
+    if (!response.success) {
       console.error('Processing failed:', response.error)
       throw new Error(response.error || 'Processing failed')
     }
+
+    try {
+      await waitForProcessing(documentId)
+    } catch (error) {
+      console.error('Processing failed:', error)
+      throw error
+    } finally {
+      await loadDocuments() // Reload documents list
+    }
   }
 
   const handleDeleteDocument = async (documentId: number) => {
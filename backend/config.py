@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
+from functools import lru_cache
+from pathlib import Path
 from typing import Optional
-import os
 
 class Settings(BaseSettings):
     # Database
@@ -8,15 +9,23 @@ class Settings(BaseSettings):
     
     # OpenAI
     openai_api_key: Optional[str] = None
+    openai_context_tokens: int = 128000  # Context window of the chat model
+    openai_max_concurrency: int = 16  # Concurrent completion calls
+    openai_max_retries: int = 5  # Retries on rate limits and transient errors
     
     # Vector Database
     chroma_db_path: str = "./chroma_db"
+    embedding_dimensions: Optional[int] = None  # Shorten embeddings (e.g. 512); needs a fresh index
+    hnsw_m: int = 32  # Graph links per vector; applied when a collection is created
+    hnsw_ef_construction: int = 200  # Candidate list size while building the index
+    hnsw_ef_search: int = 64  # Candidate list size while searching
     
     # File Storage
     upload_dir: str = "./uploads"
     
     # Application
     app_name: str = "Doc Query"
+    thread_pool_size: int = 64  # Threads for sync endpoints and blocking calls
     debug: bool = True
     
     # Frontend URL (for CORS)
@@ -27,9 +36,16 @@ class Settings(BaseSettings):
         env_file_encoding = "utf-8"
         extra = "ignore"  # Ignore extra fields in .env file
 
-# Create settings instance
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    """Get the application settings, parsed once per process"""
+    return Settings()
 
-# Ensure upload directory exists
-os.makedirs(settings.upload_dir, exist_ok=True)
-os.makedirs(settings.chroma_db_path, exist_ok=True) 
\ No newline at end of file
+def prepare_storage():
+    """Ensure upload and vector database directories exist"""
+    current_settings = get_settings()
+    Path(current_settings.upload_dir).mkdir(parents=True, exist_ok=True)
+    Path(current_settings.chroma_db_path).mkdir(parents=True, exist_ok=True)
+
+# Settings instance for existing imports
+settings = get_settings()
@@ -1,25 +1,108 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import create_engine, event, insert, Index, Column, Integer, String, Text, DateTime, Boolean, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
+from typing import AsyncGenerator, Dict, List
 from config import settings
+import json
+import orjson
 import uuid
 
-# Create database engine
+is_sqlite = "sqlite" in settings.database_url
+
+# Create database engine with a persistent connection pool
 engine = create_engine(
     settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
+    pool_size=10,
+    max_overflow=5,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    connect_args={"check_same_thread": False} if is_sqlite else {}
+)
+
+# Single-connection engine for health probes, so a saturated main pool doesn't fail them
+health_engine = create_engine(
+    settings.database_url,
+    pool_size=1,
+    max_overflow=0,
+    pool_pre_ping=True,
+    connect_args={"check_same_thread": False} if is_sqlite else {}
 )
 
-# Create session factory
+def _async_database_url(database_url: str) -> str:
+    """Map the configured database URL onto its asyncio driver"""
+    if database_url.startswith("sqlite:"):
+        return database_url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if database_url.startswith("postgresql:"):
+        return database_url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return database_url
+
+# Async engine for endpoints that await database I/O
+async_engine = create_async_engine(
+    _async_database_url(settings.database_url),
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=10,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=1800
+)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite for concurrent reads and faster writes"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+if is_sqlite:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 # Create base class for models
 Base = declarative_base()
 
+class JSONList(TypeDecorator):
+    """List stored as a JSON string, parsed once when the row is loaded"""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return orjson.dumps(value).decode() if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return orjson.loads(value) if value else []
+
+class JSONDict(TypeDecorator):
+    """Dict stored as a JSON string, parsed once when the row is loaded
+
+    Kept on a Text column so databases created before the metadata was
+    decoded on load keep working without a migration.
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return orjson.dumps(value).decode() if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        # Unprocessed documents used to store an empty string
+        return orjson.loads(value) if value else None
+
 # Tenant model
 class Tenant(Base):
     __tablename__ = "tenants"
+    __table_args__ = (
+        Index("ix_tenants_name", "name"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)
@@ -33,7 +116,7 @@ class Tenant(Base):
     max_documents = Column(Integer, default=100)
     max_chat_messages = Column(Integer, default=10000)
     max_storage_mb = Column(Integer, default=1000)
-    features_enabled = Column(Text, default="basic")  # JSON string of enabled features
+    features_enabled = Column(JSONList, default=lambda: ["basic"])  # Enabled features
     
     # Relationships
     documents = relationship("Document", back_populates="tenant")
@@ -43,25 +126,50 @@ class Tenant(Base):
 # Database models with tenant support
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        Index("ix_documents_tenant_filename", "tenant_id", "filename"),
+        Index("ix_documents_tenant_uploaded_at", "tenant_id", "uploaded_at"),
+        Index("ix_documents_tenant_id", "tenant_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False, index=True)
+    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
     filename = Column(String, index=True)
     file_path = Column(String)
     file_type = Column(String)  # pdf, md, html
-    content = Column(Text)
+    content = Column(JSONDict)  # Processing metadata, set once processed
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     is_processed = Column(Boolean, default=False)
     
     # Relationship
     tenant = relationship("Tenant", back_populates="documents")
 
+class DocumentChunk(Base):
+    __tablename__ = "document_chunks"
+    __table_args__ = (
+        Index("ix_document_chunks_document_chunk", "document_id", "chunk_index"),
+        Index("ix_document_chunks_tenant_hash", "tenant_id", "content_hash"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    content = Column(Text)
+    content_hash = Column(String(16))  # blake2b digest of content
+    chunk_metadata = Column(Text)  # JSON string of chunk metadata
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Session history lookups filter by tenant and session and sort by time
+        Index("ix_chat_messages_tenant_session_created_at", "tenant_id", "session_id", "created_at"),
+        Index("ix_chat_messages_tenant_created_at", "tenant_id", "created_at", "feedback"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False, index=True)
-    session_id = Column(String, index=True)
+    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
+    session_id = Column(String)
     message = Column(Text)
     response = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -72,9 +180,13 @@ class ChatMessage(Base):
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        Index("ix_chat_sessions_tenant_session", "tenant_id", "session_id"),
+        Index("ix_chat_sessions_tenant_created_at", "tenant_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False, index=True)
+    tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
     session_id = Column(String, unique=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -82,10 +194,40 @@ class ChatSession(Base):
     # Relationship
     tenant = relationship("Tenant", back_populates="chat_sessions")
 
+def bulk_insert_chunks(db, tenant_id: str, document_id: int, chunks: List[Dict], batch_size: int = 500) -> int:
+    """Insert processed document chunks in batches using a Core INSERT"""
+    # Keep SQLite statements well under its bound-variable limit
+    if is_sqlite:
+        batch_size = min(batch_size, 100)
+    
+    rows = [
+        {
+            "tenant_id": tenant_id,
+            "document_id": document_id,
+            "chunk_index": chunk["id"],
+            "content": chunk["content"],
+            "content_hash": chunk["metadata"].get("content_hash"),
+            "chunk_metadata": json.dumps(chunk["metadata"])
+        }
+        for chunk in chunks
+    ]
+    
+    stmt = insert(DocumentChunk.__table__)
+    for start in range(0, len(rows), batch_size):
+        db.execute(stmt, rows[start:start + batch_size])
+    db.commit()
+    
+    return len(rows)
+
 # Dependency to get database session
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# Dependency to get an async database session
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db 
\ No newline at end of file
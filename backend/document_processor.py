@@ -7,43 +7,100 @@ and validation capabilities.
 
 import os
 import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 import logging
 
 # Document parsing libraries
-import PyPDF2
-import markdown
-from bs4 import BeautifulSoup
-import html2text
+import pypdfium2
+from markdown_it import MarkdownIt
+from selectolax.parser import HTMLParser
 
 # Text processing
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import Document as LangChainDocument
 
 logger = logging.getLogger(__name__)
 
+# PDFs with more pages than this are extracted in a process pool
+PARALLEL_PDF_PAGE_THRESHOLD = 8
+
+# Markdown heading levels (h1-h3) used as section boundaries when chunking
+MARKDOWN_SECTION_LEVELS = 3
+
+# Markdown sections shorter than this are merged with their neighbours
+MIN_MARKDOWN_CHUNK_CHARS = 256
+
+# Upload limits and the number of leading bytes sniffed to check file type
+MAX_FILE_SIZE = 50 * 1024 * 1024
+VALIDATION_HEADER_BYTES = 2048
+
+def _page_text(pdf, page_idx: int) -> str:
+    """Extract text from one page of an open PDF document"""
+    page = pdf[page_idx]
+    try:
+        text_page = page.get_textpage()
+        page_text = text_page.get_text_range()
+        text_page.close()
+        return page_text
+    finally:
+        page.close()
+
+def _extract_pages(file_path: str, start: int, stop: int) -> Dict[int, str]:
+    """Extract text from a contiguous range of PDF pages (runs in a worker process)"""
+    # Open the document once per range rather than once per page
+    pdf = pypdfium2.PdfDocument(file_path)
+    try:
+        page_texts = {}
+        for page_idx in range(start, stop):
+            try:
+                page_texts[page_idx] = _page_text(pdf, page_idx)
+            except Exception as e:
+                logger.warning(f"Error extracting text from page {page_idx + 1}: {e}")
+        return page_texts
+    finally:
+        pdf.close()
+
 class DocumentProcessor:
     """Main document processing class"""
     
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    # Text cleaning patterns, compiled once
+    _WHITESPACE_RE = re.compile(r'\s+')
+    _CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]')
+    _QUOTE_DASH_TABLE = str.maketrans({
+        '\u201c': '"', '\u201d': '"',
+        '\u2018': "'", '\u2019': "'",
+        '\u2013': '-', '\u2014': '-'
+    })
+    
+    # Metadata counting patterns
+    _WORD_RE = re.compile(r'\S+')
+    _SENTENCE_END_RE = re.compile(r'[.!?]+')
+    
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, parallel_pdf: bool = True):
         """
         Initialize document processor
         
         Args:
             chunk_size: Size of text chunks in characters
             chunk_overlap: Overlap between chunks in characters
+            parallel_pdf: Extract large PDFs in a process pool (disable when
+                already running inside a worker process)
         """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.parallel_pdf = parallel_pdf
         
-        # Initialize text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        # Markdown tokenizer (no HTML rendering)
+        self._markdown_parser = MarkdownIt()
+        
+        # Process pool for large PDFs, created on first use
+        self._pdf_executor = None
+        
+        # Text splitter, shared between processors with the same settings
+        self.text_splitter = self._get_splitter(chunk_size, chunk_overlap)
         
         # Supported file types
         self.supported_types = {
@@ -67,7 +124,9 @@ class DocumentProcessor:
         """
         try:
             # Validate file exists
-            if not os.path.exists(file_path):
+            try:
+                file_size = os.stat(file_path).st_size
+            except FileNotFoundError:
                 raise FileNotFoundError(f"File not found: {file_path}")
             
             # Get file extension
@@ -77,8 +136,16 @@ class DocumentProcessor:
             if file_ext not in self.supported_types:
                 raise ValueError(f"Unsupported file type: {file_ext}")
             
-            # Parse document
-            raw_text = self.supported_types[file_ext](file_path)
+            # Parse document (HTML also yields its <title> and Markdown its
+            # sections in the same pass)
+            title = None
+            markdown_sections = None
+            if file_ext in ('.html', '.htm'):
+                raw_text, title = self._parse_html(file_path)
+            elif file_ext in ('.md', '.markdown'):
+                raw_text, markdown_sections = self._parse_markdown(file_path)
+            else:
+                raw_text = self.supported_types[file_ext](file_path)
             
             # Clean and validate text
             cleaned_text = self._clean_text(raw_text)
@@ -86,11 +153,17 @@ class DocumentProcessor:
             if not cleaned_text.strip():
                 raise ValueError("Document contains no readable text")
             
-            # Chunk the text
-            chunks = self._chunk_text(cleaned_text)
+            # Chunk the text, following section structure for Markdown
+            if file_ext in ('.md', '.markdown'):
+                chunks = self._chunk_markdown(markdown_sections, cleaned_text)
+            else:
+                chunks = self._chunk_text(cleaned_text)
+            
+            # Drop repeated chunks (e.g. boilerplate headers and footers)
+            chunks = self._dedupe_chunks(chunks)
             
             # Extract metadata
-            metadata = self._extract_metadata(file_path, file_ext, cleaned_text)
+            metadata = self._extract_metadata(file_path, file_ext, cleaned_text, file_size, title)
             
             return {
                 'success': True,
@@ -110,74 +183,161 @@ class DocumentProcessor:
                 'file_path': file_path
             }
     
+    @classmethod
+    @lru_cache(maxsize=8)
+    def _get_splitter(cls, chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+        """Get a text splitter for the given chunk settings"""
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True
+        )
+    
+    def _get_pdf_executor(self) -> ProcessPoolExecutor:
+        """Get the process pool used for parallel PDF page extraction"""
+        if self._pdf_executor is None:
+            self._pdf_executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+        return self._pdf_executor
+    
+    def close(self):
+        """Shut down the PDF process pool, if one was started"""
+        if self._pdf_executor is not None:
+            self._pdf_executor.shutdown(wait=False, cancel_futures=True)
+            self._pdf_executor = None
+    
     def _parse_pdf(self, file_path: str) -> str:
         """Parse PDF file and extract text"""
         try:
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                for page_num, page in enumerate(pdf_reader.pages):
+            page_texts = {}
+            # Pass the path so PDFium reads the file natively; file-like
+            # inputs (including mmap) go through per-block Python callbacks
+            pdf = pypdfium2.PdfDocument(file_path)
+            try:
+                page_count = len(pdf)
+                # Small documents aren't worth the process pool overhead
+                parallel = self.parallel_pdf and page_count > PARALLEL_PDF_PAGE_THRESHOLD
+                if not parallel:
+                    for page_idx in range(page_count):
+                        try:
+                            page_texts[page_idx] = _page_text(pdf, page_idx)
+                        except Exception as e:
+                            logger.warning(f"Error extracting text from page {page_idx + 1}: {e}")
+            finally:
+                pdf.close()
+            
+            if parallel:
+                executor = self._get_pdf_executor()
+                # One contiguous slice of pages per worker
+                slice_size = -(-page_count // (os.cpu_count() or 1))
+                futures = {
+                    executor.submit(_extract_pages, file_path, start, min(start + slice_size, page_count)): start
+                    for start in range(0, page_count, slice_size)
+                }
+                for future in as_completed(futures):
+                    start = futures[future]
                     try:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += f"\n\n--- Page {page_num + 1} ---\n\n"
-                            text += page_text
+                        page_texts.update(future.result())
                     except Exception as e:
-                        logger.warning(f"Error extracting text from page {page_num + 1}: {e}")
-                        continue
+                        logger.warning(f"Error extracting text from pages starting at {start + 1}: {e}")
             
-            return text
+            return "".join(
+                f"\n\n--- Page {page_idx + 1} ---\n\n{page_texts[page_idx]}"
+                for page_idx in sorted(page_texts)
+                if page_texts[page_idx]
+            )
             
         except Exception as e:
             raise Exception(f"Failed to parse PDF: {str(e)}")
     
-    def _parse_markdown(self, file_path: str) -> str:
-        """Parse Markdown file and extract text"""
+    def _parse_markdown(self, file_path: str) -> Tuple[str, List[Tuple[str, str]]]:
+        """
+        Parse Markdown file and extract text and its sections
+        
+        Returns:
+            Tuple of (text, [(heading location, section text)]) where sections
+            are split at h1-h3 headings
+        """
         try:
             with open(file_path, 'r', encoding='utf-8') as file:
                 content = file.read()
             
-            # Convert markdown to HTML first, then extract text
-            html = markdown.markdown(content)
-            soup = BeautifulSoup(html, 'html.parser')
+            # Walk the token stream directly instead of rendering to HTML
+            tokens = self._markdown_parser.parse(content)
             
-            # Extract text while preserving some structure
-            text = ""
-            for element in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li', 'blockquote']):
-                if element.name.startswith('h'):
-                    text += f"\n\n{element.get_text().strip()}\n"
-                elif element.name == 'p':
-                    text += f"\n{element.get_text().strip()}"
-                elif element.name == 'li':
-                    text += f"\n• {element.get_text().strip()}"
-                elif element.name == 'blockquote':
-                    text += f"\n> {element.get_text().strip()}"
+            # Extract text while preserving some structure, collecting the
+            # text under each section heading as we go
+            parts = []
+            sections = []
+            headings = []
+            section_parts = []
+            blocks = []
+            heading_level = 0
+            for token in tokens:
+                if token.nesting == 1:
+                    blocks.append(token.type)
+                    if token.type == 'heading_open':
+                        heading_level = int(token.tag[1:])
+                elif token.nesting == -1:
+                    blocks.pop()
+                elif token.type == 'inline':
+                    inline_text = self._inline_text(token).strip()
+                    if blocks[-1] == 'heading_open':
+                        parts.append(f"\n\n{inline_text}\n")
+                        if heading_level <= MARKDOWN_SECTION_LEVELS:
+                            # Close the current section and start a new one
+                            sections.append((" > ".join(headings), "".join(section_parts)))
+                            section_parts = []
+                            headings = headings[:heading_level - 1] + [inline_text]
+                            continue
+                    elif 'list_item_open' in blocks:
+                        parts.append(f"\n• {inline_text}")
+                    elif 'blockquote_open' in blocks:
+                        parts.append(f"\n> {inline_text}")
+                    elif blocks[-1] == 'paragraph_open':
+                        parts.append(f"\n{inline_text}")
+                    else:
+                        continue
+                    section_parts.append(parts[-1])
+            sections.append((" > ".join(headings), "".join(section_parts)))
             
-            return text.strip()
+            return "".join(parts).strip(), sections
             
         except Exception as e:
             raise Exception(f"Failed to parse Markdown: {str(e)}")
     
-    def _parse_html(self, file_path: str) -> str:
-        """Parse HTML file and extract text"""
+    @staticmethod
+    def _inline_text(token) -> str:
+        """Get plain text from an inline Markdown token"""
+        parts = []
+        for child in token.children or []:
+            if child.type in ('text', 'code_inline'):
+                parts.append(child.content)
+            elif child.type in ('softbreak', 'hardbreak'):
+                parts.append('\n')
+            elif child.type == 'image':
+                parts.append(child.content)
+        return ''.join(parts)
+    
+    def _parse_html(self, file_path: str) -> Tuple[str, Optional[str]]:
+        """Parse HTML file and extract text and title"""
         try:
             with open(file_path, 'r', encoding='utf-8') as file:
                 content = file.read()
             
-            # Use html2text for better text extraction
-            h = html2text.HTML2Text()
-            h.ignore_links = False
-            h.ignore_images = False
-            h.body_width = 0  # No line wrapping
+            tree = HTMLParser(content)
+            
+            title_node = tree.css_first('title')
+            title = title_node.text().strip() if title_node else None
             
-            text = h.handle(content)
+            # Drop non-content elements before extracting text
+            for node in tree.css('script, style, nav, footer'):
+                node.decompose()
             
-            # Clean up the text
-            text = re.sub(r'\n\s*\n', '\n\n', text)  # Remove excessive newlines
-            text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)  # Remove markdown links
+            text = tree.body.text(separator='\n') if tree.body else ''
             
-            return text.strip()
+            return text.strip(), title or None
             
         except Exception as e:
             raise Exception(f"Failed to parse HTML: {str(e)}")
@@ -185,15 +345,9 @@ class DocumentProcessor:
     def _parse_text(self, file_path: str) -> str:
         """Parse plain text file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
+            # Undecodable bytes are replaced so the file is only read once
+            with open(file_path, 'r', encoding='utf-8', errors='replace', buffering=1 << 20) as file:
                 return file.read()
-        except UnicodeDecodeError:
-            # Try with different encoding
-            try:
-                with open(file_path, 'r', encoding='latin-1') as file:
-                    return file.read()
-            except Exception as e:
-                raise Exception(f"Failed to read text file: {str(e)}")
         except Exception as e:
             raise Exception(f"Failed to parse text file: {str(e)}")
     
@@ -202,30 +356,23 @@ class DocumentProcessor:
         if not text:
             return ""
         
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove excessive newlines
-        text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+        # Collapse whitespace first (this also removes excessive newlines), so
+        # whitespace control characters like page-break form feeds become spaces
+        text = self._WHITESPACE_RE.sub(' ', text)
         
         # Remove special characters that might cause issues
-        text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+        text = self._CONTROL_CHARS_RE.sub('', text)
         
         # Normalize quotes and dashes
-        text = text.replace('"', '"').replace('"', '"')
-        text = text.replace(''', "'").replace(''', "'")
-        text = text.replace('–', '-').replace('—', '-')
+        text = text.translate(self._QUOTE_DASH_TABLE)
         
         return text.strip()
     
     def _chunk_text(self, text: str) -> List[Dict]:
         """Split text into chunks using LangChain text splitter"""
         try:
-            # Create LangChain document
-            doc = LangChainDocument(page_content=text, metadata={})
-            
-            # Split into chunks
-            chunks = self.text_splitter.split_documents([doc])
+            # Split into chunks (start offsets are recorded during the split)
+            chunks = self.text_splitter.create_documents([text])
             
             # Convert to our format
             result = []
@@ -236,7 +383,7 @@ class DocumentProcessor:
                     'metadata': {
                         'chunk_id': i,
                         'chunk_size': len(chunk.page_content),
-                        'start_char': text.find(chunk.page_content) if chunk.page_content in text else 0
+                        'start_char': chunk.metadata.get('start_index', 0)
                     }
                 })
             
@@ -247,6 +394,68 @@ class DocumentProcessor:
             # Fallback: simple chunking
             return self._simple_chunk_text(text)
     
+    def _chunk_markdown(self, sections: List[Tuple[str, str]], cleaned_text: str) -> List[Dict]:
+        """Split parsed Markdown sections into chunks prefixed with their location"""
+        try:
+            # Greedily merge small adjacent sections; each keeps its own prefix
+            merged = []
+            for location, section_text in sections:
+                section_text = self._clean_text(section_text)
+                if not section_text:
+                    continue
+                
+                prefix = f"[Location: {location}] " if location else ""
+                if merged:
+                    prev_location, prev_text, prev_start = merged[-1]
+                    is_small = len(prev_text) < MIN_MARKDOWN_CHUNK_CHARS or len(section_text) < MIN_MARKDOWN_CHUNK_CHARS
+                    if is_small and len(prev_text) + len(prefix) + len(section_text) + 1 <= self.chunk_size:
+                        merged[-1] = (prev_location, f"{prev_text} {prefix}{section_text}", prev_start)
+                        continue
+                
+                merged.append((location, prefix + section_text, len(prefix)))
+            
+            if not merged:
+                return self._chunk_text(cleaned_text)
+            
+            # Re-split oversized sections, keeping each piece's offset into the
+            # cleaned document text
+            result = []
+            cursor = 0
+            for location, section_text, prefix_length in merged:
+                prefix = section_text[:prefix_length]
+                body = section_text[prefix_length:]
+                if len(section_text) > self.chunk_size:
+                    pieces = self.text_splitter.split_text(body)
+                else:
+                    pieces = [body]
+                
+                for piece in pieces:
+                    start_char = cleaned_text.find(piece[:64], cursor)
+                    if start_char == -1:
+                        start_char = cursor
+                    cursor = start_char
+                    
+                    chunk_id = len(result)
+                    chunk_content = prefix + piece
+                    result.append({
+                        'id': chunk_id,
+                        'content': chunk_content,
+                        'metadata': {
+                            'chunk_id': chunk_id,
+                            'chunk_size': len(chunk_content),
+                            'start_char': start_char,
+                            'section': location,
+                            'method': 'markdown'
+                        }
+                    })
+            
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error chunking Markdown: {str(e)}")
+            # Fallback: generic chunking of the cleaned text
+            return self._chunk_text(cleaned_text)
+    
     def _simple_chunk_text(self, text: str) -> List[Dict]:
         """Simple text chunking as fallback"""
         chunks = []
@@ -287,26 +496,52 @@ class DocumentProcessor:
         
         return chunks
     
-    def _extract_metadata(self, file_path: str, file_type: str, text: str) -> Dict:
+    def _dedupe_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        """Remove duplicate chunks by content hash and renumber the rest"""
+        seen_hashes = set()
+        result = []
+        for chunk in chunks:
+            content_hash = hashlib.blake2b(chunk['content'].encode('utf-8'), digest_size=8).hexdigest()
+            if content_hash in seen_hashes:
+                continue
+            seen_hashes.add(content_hash)
+            
+            chunk_id = len(result)
+            chunk['id'] = chunk_id
+            chunk['metadata']['chunk_id'] = chunk_id
+            chunk['metadata']['content_hash'] = content_hash
+            result.append(chunk)
+        
+        return result
+    
+    def _extract_metadata(
+        self,
+        file_path: str,
+        file_type: str,
+        text: str,
+        file_size: Optional[int] = None,
+        title: Optional[str] = None
+    ) -> Dict:
         """Extract metadata from document"""
         filename = os.path.basename(file_path)
-        file_size = os.path.getsize(file_path)
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
         
         metadata = {
             'filename': filename,
             'file_type': file_type,
             'file_size': file_size,
             'total_chars': len(text),
-            'total_words': len(text.split()),
-            'total_sentences': len(re.split(r'[.!?]+', text)),
+            'total_words': sum(1 for _ in self._WORD_RE.finditer(text)),
+            'total_sentences': sum(1 for _ in self._SENTENCE_END_RE.finditer(text)) + 1,
             'processing_timestamp': None  # Will be set by caller
         }
         
-        # Extract title if possible
-        if file_type in ['.md', '.html']:
+        # Extract title if the parser didn't provide one
+        if not title and file_type in ['.md', '.html', '.htm']:
             title = self._extract_title(text, file_type)
-            if title:
-                metadata['title'] = title
+        if title:
+            metadata['title'] = title
         
         return metadata
     
@@ -322,13 +557,6 @@ class DocumentProcessor:
                 elif line.startswith('## '):
                     return line[3:].strip()
         
-        elif file_type in ['.html', '.htm']:
-            # Look for HTML title tags
-            soup = BeautifulSoup(text, 'html.parser')
-            title_tag = soup.find('title')
-            if title_tag:
-                return title_tag.get_text().strip()
-        
         # Fallback: use first non-empty line
         for line in lines:
             if line.strip() and len(line.strip()) > 3:
@@ -336,31 +564,64 @@ class DocumentProcessor:
         
         return None
     
-    def validate_document(self, file_path: str) -> Dict:
+    def _content_matches_type(self, file_ext: str, header: bytes) -> bool:
+        """Check the leading bytes of a file against its extension"""
+        # PDFs start with the %PDF- magic (after optional leading whitespace);
+        # text files that merely mention it are not PDFs
+        is_pdf = header.lstrip().startswith(b'%PDF-')
+        if file_ext == '.pdf':
+            return is_pdf
+        
+        # Remaining supported types are text formats
+        return not is_pdf and b'\x00' not in header
+    
+    def validate_document(self, file_path: str, file_size: Optional[int] = None) -> Dict:
         """Validate document before processing"""
         try:
-            # Check file exists
-            if not os.path.exists(file_path):
-                return {'valid': False, 'error': 'File does not exist'}
-            
-            # Check file size
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                return {'valid': False, 'error': 'File is empty'}
-            
-            if file_size > 50 * 1024 * 1024:  # 50MB limit
-                return {'valid': False, 'error': 'File too large (max 50MB)'}
+            # Check file exists (skipped when the caller already knows the size)
+            if file_size is None:
+                try:
+                    file_size = os.stat(file_path).st_size
+                except FileNotFoundError:
+                    return {'valid': False, 'error': 'File does not exist'}
             
-            # Check file type
-            file_ext = Path(file_path).suffix.lower()
-            if file_ext not in self.supported_types:
-                return {
-                    'valid': False, 
-                    'error': f'Unsupported file type: {file_ext}',
-                    'supported_types': list(self.supported_types.keys())
-                }
+            with open(file_path, 'rb') as file:
+                header = file.read(VALIDATION_HEADER_BYTES)
             
-            return {'valid': True, 'file_size': file_size, 'file_type': file_ext}
+            return self.validate_from_stats(Path(file_path).suffix.lower(), file_size, header)
             
         except Exception as e:
-            return {'valid': False, 'error': str(e)} 
\ No newline at end of file
+            return {'valid': False, 'error': str(e)}
+    
+    def validate_from_stats(self, file_ext: str, file_size: int, header: bytes) -> Dict:
+        """
+        Validate a document from its extension, size, and leading bytes
+        
+        Args:
+            file_ext: Lowercase file extension including the dot
+            file_size: File size in bytes
+            header: Leading bytes of the file (up to VALIDATION_HEADER_BYTES)
+            
+        Returns:
+            Validation result
+        """
+        # Check file size
+        if file_size == 0:
+            return {'valid': False, 'error': 'File is empty'}
+        
+        if file_size > MAX_FILE_SIZE:
+            return {'valid': False, 'error': 'File too large (max 50MB)'}
+        
+        # Check file type
+        if file_ext not in self.supported_types:
+            return {
+                'valid': False, 
+                'error': f'Unsupported file type: {file_ext}',
+                'supported_types': list(self.supported_types.keys())
+            }
+        
+        # Check file contents match the extension
+        if not self._content_matches_type(file_ext, header):
+            return {'valid': False, 'error': f'File contents do not match file type: {file_ext}'}
+        
+        return {'valid': True, 'file_size': file_size, 'file_type': file_ext}
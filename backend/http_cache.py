@@ -0,0 +1,36 @@
+"""
+HTTP Caching for Doc Query
+
+Adds Cache-Control and ETag headers to frequently polled endpoints so that
+browsers and reverse proxies can reuse responses, and answers matching
+conditional requests with 304 Not Modified.
+"""
+
+import hashlib
+from typing import Any
+import orjson
+from fastapi import Request, Response
+
+def cached_json_response(request: Request, content: Any, max_age: int, private: bool = False) -> Response:
+    """
+    Build a JSON response that clients may cache
+
+    Args:
+        request: Incoming request (checked for If-None-Match)
+        content: JSON-serializable response body
+        max_age: Seconds the response may be reused
+        private: Only allow the client to cache (for tenant-specific data)
+
+    Returns:
+        JSON response, or an empty 304 response if the client's copy is current
+    """
+    body = orjson.dumps(content)
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {
+        "Cache-Control": f"{'private' if private else 'public'}, max-age={max_age}",
+        "ETag": etag
+    }
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,178 @@
+"""
+Background Document Ingestion for Doc Query
+
+Runs document parsing in a process pool behind a bounded queue so that
+request handlers return immediately instead of waiting for extraction,
+chunking, and vector indexing.
+"""
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set
+from sqlalchemy import update
+from database import SessionLocal, Document, bulk_insert_chunks
+from document_processor import DocumentProcessor
+from vector_store import get_vector_store
+from semantic_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Errors kept from failed processing attempts (oldest are dropped)
+MAX_TRACKED_ERRORS = 1000
+
+# Processor reused by each worker process. The ingestion pool already runs
+# one document per CPU, so PDF pages are extracted serially instead of
+# starting a nested process pool per document.
+_worker_processor: Optional[DocumentProcessor] = None
+
+def _parse_document(file_path: str) -> Dict:
+    """Parse and chunk a document (runs in a worker process)"""
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = DocumentProcessor(parallel_pdf=False)
+    return _worker_processor.process_document(file_path)
+
+class IngestionQueue:
+    """Bounded queue of documents waiting to be processed and indexed"""
+
+    def __init__(self, max_queued: int = 100, num_workers: int = 2):
+        """
+        Initialize ingestion queue
+
+        Args:
+            max_queued: Maximum number of documents waiting for processing
+            num_workers: Number of documents processed concurrently
+        """
+        self.max_queued = max_queued
+        self.num_workers = num_workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Set[int] = set()
+        self._errors = LRUCache(max_entries=MAX_TRACKED_ERRORS)
+
+    async def start(self):
+        """Start the process pool and worker tasks"""
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.num_workers)
+        ]
+        logger.info(f"Started document ingestion with {self.num_workers} workers")
+
+    async def stop(self):
+        """Cancel worker tasks and shut down the process pool"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def is_pending(self, document_id: int) -> bool:
+        """Check whether a document is queued or being processed"""
+        return document_id in self._pending
+
+    def get_error(self, document_id: int) -> Optional[str]:
+        """Get the error from a document's last failed processing attempt"""
+        return self._errors.get(document_id)
+
+    def enqueue(self, document_id: int, tenant_id: str, file_path: str) -> bool:
+        """
+        Queue a document for processing
+
+        Args:
+            document_id: Database document ID
+            tenant_id: Tenant that owns the document
+            file_path: Path to the stored document file
+
+        Returns:
+            True if queued, False if the queue is full
+        """
+        if self._queue is None:
+            raise RuntimeError("Ingestion queue is not running")
+
+        try:
+            self._queue.put_nowait((document_id, tenant_id, file_path))
+        except asyncio.QueueFull:
+            return False
+
+        self._pending.add(document_id)
+        self._errors.pop(document_id)
+        return True
+
+    async def _worker(self):
+        """Take documents off the queue and process them"""
+        loop = asyncio.get_running_loop()
+        while True:
+            document_id, tenant_id, file_path = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(self._executor, _parse_document, file_path)
+
+                if not result['success']:
+                    logger.error(f"Processing failed for document {document_id}: {result['error']}")
+                    self._errors.set(document_id, result['error'])
+                    continue
+
+                await asyncio.to_thread(self._store_result, document_id, tenant_id, result)
+
+            except Exception as e:
+                logger.error(f"Failed to ingest document {document_id}: {str(e)}")
+                self._errors.set(document_id, str(e))
+            finally:
+                self._pending.discard(document_id)
+                self._queue.task_done()
+
+    @staticmethod
+    def _store_result(document_id: int, tenant_id: str, result: Dict):
+        """Index processed chunks and mark the document as processed"""
+        db = SessionLocal()
+        try:
+            # Skip indexing documents deleted while queued or processing
+            if db.get(Document, document_id) is None:
+                logger.warning(f"Document {document_id} was deleted before indexing")
+                return
+            # Don't hold the read transaction open while embedding
+            db.rollback()
+
+            vector_store = get_vector_store(tenant_id)
+            indexed = vector_store.index_document(
+                document_id=document_id,
+                chunks=result['chunks'],
+                metadata=result['metadata']
+            )
+
+            # Update document with processed data in a single statement
+            updated = db.execute(
+                update(Document)
+                .where(Document.id == document_id)
+                .values(
+                    is_processed=True,
+                    content={
+                        'metadata': result['metadata'],
+                        'chunks_count': len(result['chunks']),
+                        'total_chars': result['metadata']['total_chars'],
+                        'total_words': result['metadata']['total_words'],
+                        'indexed': indexed
+                    }
+                )
+            )
+            if updated.rowcount == 0:
+                logger.warning(f"Document {document_id} was deleted during processing")
+                db.rollback()
+                # Don't leave its chunks behind for searches to cite
+                vector_store.delete_document(document_id)
+                return
+
+            # Persist chunks alongside the document (commits the update too)
+            bulk_insert_chunks(db, tenant_id, document_id, result['chunks'])
+            logger.info(f"Processed document {document_id} ({len(result['chunks'])} chunks)")
+        finally:
+            db.close()
+
+# Shared ingestion queue, started with the application
+ingestion_queue = IngestionQueue()
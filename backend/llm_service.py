@@ -7,16 +7,48 @@ prompt engineering, and streaming response support.
 
 import os
 import json
+import asyncio
+import random
+import hashlib
 import logging
 from typing import List, Dict, Optional, AsyncGenerator, Tuple
 from datetime import datetime
+import httpx
 import openai
+import orjson
+import tiktoken
+from fastapi import Request
 from openai import AsyncOpenAI
 from config import settings
-from vector_store import VectorStore
+from vector_store import VectorStore, get_vector_store, query_cache_key
+from semantic_cache import semantic_cache, exact_response_cache, query_embedding_cache, search_result_cache, document_chunks_cache, tenant_cache_prefix
 
 logger = logging.getLogger(__name__)
 
+# Queries shorter than this (after stripping) are rejected without a search
+MIN_QUERY_CHARS = 3
+TRIVIAL_QUERY_RESPONSE = "Please ask a question about your documents."
+
+# Approximate tokens added around each chunk by _prepare_context
+CONTEXT_CHUNK_OVERHEAD_TOKENS = 32
+
+# Approximate tokens used by the summary and keyword instructions
+DOCUMENT_PROMPT_TOKENS = 128
+
+# Errors worth retrying with exponential backoff
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+
+# Concurrent summary/keyword requests are collected for this long (seconds)
+# and sent together in one completion call, up to the batch size
+ANALYSIS_BATCH_WINDOW = 0.05
+ANALYSIS_BATCH_SIZE = 8
+
 class LLMService:
     """OpenAI GPT-4 LLM service with RAG capabilities"""
     
@@ -25,11 +57,19 @@ class LLMService:
         if not settings.openai_api_key:
             raise ValueError("OpenAI API key not configured")
         
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
-        self.vector_store = VectorStore()
+        # HTTP/2 keep-alive pool sized for concurrent requests from a shared service
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=75),
+                timeout=httpx.Timeout(60.0, connect=5.0)
+            )
+        )
+        self.vector_store = get_vector_store()
         self.model = "gpt-4-turbo-preview"  # Latest GPT-4 model
         
-        # Default system prompt for RAG
+        # Default system prompt for RAG (static guidelines only)
         self.default_system_prompt = """You are Doc Query, an intelligent document assistant. Your role is to help users find and understand information from their uploaded documents.
 
 Key Guidelines:
@@ -39,11 +79,33 @@ Key Guidelines:
 4. Cite specific parts of documents when possible
 5. If asked about something not in the documents, politely redirect to the document content
 6. Use a friendly, professional tone
-7. Structure responses clearly with proper formatting
-
-Document Context: {context}
+7. Structure responses clearly with proper formatting"""
+        
+        # Per-request user message for RAG. Context stays out of the system
+        # prompt so the static prefix is identical across requests and can be
+        # served from OpenAI's prompt cache.
+        self.default_user_template = """Document Context: {context}
 
 User Question: {question}"""
+        
+        # Split the template once so messages are built with a single join
+        self._prompt_prefix, rest = self.default_user_template.split("{context}")
+        self._prompt_mid, self._prompt_suffix = rest.split("{question}")
+        
+        # Bound concurrent completion calls to stay under the account's rate limits
+        self._completion_semaphore = asyncio.Semaphore(settings.openai_max_concurrency)
+        self._completions = self.client.with_options(max_retries=0).chat.completions
+        
+        # Micro-batching of concurrent summary and keyword requests
+        self._analysis_queue: Optional[asyncio.Queue] = None
+        self._analysis_worker: Optional[asyncio.Task] = None
+        self._analysis_tasks = set()
+        
+        # Tokenizer used to keep prompts within the model's context window
+        self.encoding = tiktoken.encoding_for_model(self.model)
+        self._prompt_tokens = len(self.encoding.encode(
+            self.default_system_prompt + self._prompt_prefix + self._prompt_mid + self._prompt_suffix
+        ))
     
     async def generate_rag_response(
         self,
@@ -67,24 +129,46 @@ User Question: {question}"""
         Returns:
             Dictionary with response and metadata
         """
+        # Skip retrieval and generation for empty or accidental submissions;
+        # the canned reply is a normal answer, not an error
+        if len(query.strip()) < MIN_QUERY_CHARS:
+            return {
+                'success': True,
+                'response': TRIVIAL_QUERY_RESPONSE,
+                'citations': [],
+                'metadata': {'chunks_retrieved': 0, 'total_tokens': 0}
+            }
+        
         try:
             # Use tenant-specific vector store if tenant_id is provided
             if tenant_id:
-                vector_store = VectorStore(tenant_id=tenant_id)
+                vector_store = await asyncio.to_thread(get_vector_store, tenant_id)
             else:
                 vector_store = self.vector_store
             
+            # Embed the query once for both the cache lookup and retrieval
+            query_embedding = await self._embed_query(vector_store, query)
+            
+            # Answer from the semantic cache if a similar question was asked recently
+            use_cache = system_prompt is None
+            cache_namespace = self._cache_namespace(tenant_id, n_context_chunks, temperature, max_tokens)
+            if use_cache:
+                cached = semantic_cache.lookup(cache_namespace, query_embedding)
+                if cached:
+                    return {**cached, 'metadata': {**cached['metadata'], 'cache_hit': True}}
+            
             # Retrieve relevant document chunks
-            context_chunks = vector_store.search_similar(
-                query=query,
-                n_results=n_context_chunks
+            context_chunks = await self._search(
+                vector_store, cache_namespace, query, n_context_chunks, query_embedding
             )
             
+            # Drop the least relevant chunks that would overflow the context window
+            context_chunks, chunks_dropped = self._fit_context(context_chunks, query, max_tokens)
+            
             if not context_chunks:
                 return {
                     'success': False,
                     'response': "I couldn't find any relevant information in your documents to answer this question. Please try rephrasing your query or upload relevant documents.",
-                    'context_used': [],
                     'citations': [],
                     'metadata': {
                         'chunks_retrieved': 0,
@@ -93,22 +177,23 @@ User Question: {question}"""
                     }
                 }
             
+            # Same question over the same chunks: reuse the previous answer
+            if use_cache:
+                exact_key = self._exact_cache_key(cache_namespace, query, context_chunks)
+                cached = exact_response_cache.get(exact_key)
+                if cached:
+                    return {**cached, 'metadata': {**cached['metadata'], 'cache_hit': True}}
+            
             # Prepare context from chunks
             context_text = self._prepare_context(context_chunks)
             
-            # Use custom or default system prompt
-            final_system_prompt = system_prompt or self.default_system_prompt.format(
-                context=context_text,
-                question=query
-            )
+            # Use custom or default prompt
+            messages = self._build_messages(system_prompt, context_text, query)
             
             # Generate response
-            response = await self.client.chat.completions.create(
+            response = await self._create_completion(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": final_system_prompt},
-                    {"role": "user", "content": query}
-                ],
+                messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens
             )
@@ -119,10 +204,9 @@ User Question: {question}"""
             # Prepare citations from context chunks
             citations = self._prepare_citations(context_chunks)
             
-            return {
+            result = {
                 'success': True,
                 'response': response_content,
-                'context_used': context_chunks,
                 'citations': citations,
                 'metadata': {
                     'chunks_retrieved': len(context_chunks),
@@ -130,16 +214,22 @@ User Question: {question}"""
                     'prompt_tokens': response.usage.prompt_tokens,
                     'completion_tokens': response.usage.completion_tokens,
                     'model_used': self.model,
-                    'temperature': temperature
+                    'temperature': temperature,
+                    'chunks_dropped': chunks_dropped
                 }
             }
             
+            if use_cache:
+                semantic_cache.insert(cache_namespace, query_embedding, result)
+                exact_response_cache.set(exact_key, result)
+            
+            return result
+            
         except Exception as e:
             logger.error(f"Failed to generate RAG response: {str(e)}")
             return {
                 'success': False,
                 'response': f"Sorry, I encountered an error while processing your request: {str(e)}",
-                'context_used': [],
                 'metadata': {'error': str(e)}
             }
     
@@ -165,19 +255,44 @@ User Question: {question}"""
         Yields:
             Streaming response chunks
         """
+        # Skip retrieval and generation for empty or accidental submissions
+        if len(query.strip()) < MIN_QUERY_CHARS:
+            yield {
+                'type': 'error',
+                'content': TRIVIAL_QUERY_RESPONSE,
+                'metadata': {'chunks_retrieved': 0},
+                'citations': []
+            }
+            return
+        
         try:
             # Use tenant-specific vector store if tenant_id is provided
             if tenant_id:
-                vector_store = VectorStore(tenant_id=tenant_id)
+                vector_store = await asyncio.to_thread(get_vector_store, tenant_id)
             else:
                 vector_store = self.vector_store
             
+            # Embed the query once for both the cache lookup and retrieval
+            query_embedding = await self._embed_query(vector_store, query)
+            
+            # Replay a cached answer if a similar question was asked recently
+            use_cache = system_prompt is None
+            cache_namespace = self._cache_namespace(tenant_id, n_context_chunks, temperature, max_tokens)
+            if use_cache:
+                cached = semantic_cache.lookup(cache_namespace, query_embedding)
+                if cached:
+                    for chunk in self._replay_cached_response(cached):
+                        yield chunk
+                    return
+            
             # Retrieve relevant document chunks
-            context_chunks = vector_store.search_similar(
-                query=query,
-                n_results=n_context_chunks
+            context_chunks = await self._search(
+                vector_store, cache_namespace, query, n_context_chunks, query_embedding
             )
             
+            # Drop the least relevant chunks that would overflow the context window
+            context_chunks, chunks_dropped = self._fit_context(context_chunks, query, max_tokens)
+            
             if not context_chunks:
                 yield {
                     'type': 'error',
@@ -187,58 +302,78 @@ User Question: {question}"""
                 }
                 return
             
+            # Same question over the same chunks: replay the previous answer
+            if use_cache:
+                exact_key = self._exact_cache_key(cache_namespace, query, context_chunks)
+                cached = exact_response_cache.get(exact_key)
+                if cached:
+                    for chunk in self._replay_cached_response(cached):
+                        yield chunk
+                    return
+            
             # Prepare context from chunks
             context_text = self._prepare_context(context_chunks)
             
-            # Use custom or default system prompt
-            final_system_prompt = system_prompt or self.default_system_prompt.format(
-                context=context_text,
-                question=query
-            )
-            
-            # Generate streaming response
-            stream = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": final_system_prompt},
-                    {"role": "user", "content": query}
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-            
-            # Stream response chunks
-            full_response = ""
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    full_response += content
-                    
-                    yield {
-                        'type': 'content',
-                        'content': content,
-                        'metadata': {
-                            'chunks_retrieved': len(context_chunks),
-                            'model_used': self.model
-                        }
+            # Use custom or default prompt
+            messages = self._build_messages(system_prompt, context_text, query)
+            
+            # Hold a concurrency slot until the stream is fully read; the
+            # stream is the longest-lived completion call
+            async with self._completion_semaphore:
+                # Generate streaming response
+                stream = await self._create_completion(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                )
+                
+                # Send the constant stream metadata once, ahead of the content
+                yield {
+                    'type': 'start',
+                    'metadata': {
+                        'chunks_retrieved': len(context_chunks),
+                        'model_used': self.model
                     }
+                }
+                
+                # Stream response chunks
+                response_parts = []
+                async for chunk in stream:
+                    if chunk.choices[0].delta.content:
+                        content = chunk.choices[0].delta.content
+                        response_parts.append(content)
+                        
+                        yield {'type': 'content', 'content': content}
+            full_response = "".join(response_parts)
             
             # Prepare citations from context chunks
             citations = self._prepare_citations(context_chunks)
             
-            # Send final metadata with citations
+            metadata = {
+                'chunks_retrieved': len(context_chunks),
+                'model_used': self.model,
+                'temperature': temperature,
+                'total_length': len(full_response),
+                'chunks_dropped': chunks_dropped
+            }
+            
+            if use_cache:
+                result = {
+                    'success': True,
+                    'response': full_response,
+                    'citations': citations,
+                    'metadata': metadata
+                }
+                semantic_cache.insert(cache_namespace, query_embedding, result)
+                exact_response_cache.set(exact_key, result)
+            
+            # Send final metadata with citations (the text was already streamed)
             yield {
                 'type': 'complete',
-                'content': full_response,
-                'context_used': context_chunks,
                 'citations': citations,
-                'metadata': {
-                    'chunks_retrieved': len(context_chunks),
-                    'model_used': self.model,
-                    'temperature': temperature,
-                    'total_length': len(full_response)
-                }
+                'metadata': metadata
             }
             
         except Exception as e:
@@ -249,6 +384,173 @@ User Question: {question}"""
                 'metadata': {'error': str(e)}
             }
     
+    async def _create_completion(self, **kwargs):
+        """
+        Create a chat completion with bounded concurrency and retries
+        
+        Rate limit, connection, and server errors are retried with
+        exponential backoff and jitter. For streams (stream=True) the caller
+        must hold the completion semaphore until the stream is consumed.
+        
+        Args:
+            **kwargs: Arguments for chat.completions.create
+            
+        Returns:
+            Completion response (or stream)
+        """
+        attempt = 0
+        while True:
+            try:
+                if kwargs.get('stream'):
+                    # Streaming callers hold the slot while reading the stream
+                    return await self._completions.create(**kwargs)
+                async with self._completion_semaphore:
+                    return await self._completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= settings.openai_max_retries:
+                    raise
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) + random.random() * RETRY_BASE_DELAY
+                attempt += 1
+                logger.warning(f"OpenAI request failed ({type(e).__name__}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    def _build_messages(self, system_prompt: Optional[str], context_text: str, query: str) -> List[Dict]:
+        """Build chat messages for a RAG request"""
+        if system_prompt:
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": query}
+            ]
+        
+        user_message = "".join((self._prompt_prefix, context_text, self._prompt_mid, query, self._prompt_suffix))
+        return [
+            {"role": "system", "content": self.default_system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+    
+    async def _embed_query(self, vector_store: VectorStore, query: str) -> List[float]:
+        """Embed a query, reusing the embedding for repeated query text"""
+        # Check the cache here first so hits don't need a worker thread
+        embedding = query_embedding_cache.get(query_cache_key(query))
+        if embedding is None:
+            embedding = await asyncio.to_thread(vector_store.embed_query, query)
+        return embedding
+    
+    def _cache_namespace(self, tenant_id: Optional[str], n_context_chunks: int, temperature: float, max_tokens: int) -> str:
+        """Partition cached responses by tenant and generation settings"""
+        return f"{tenant_cache_prefix(tenant_id)}{self.model}:{n_context_chunks}:{temperature}:{max_tokens}"
+    
+    async def _search(
+        self,
+        vector_store: VectorStore,
+        namespace: str,
+        query: str,
+        n_results: int,
+        query_embedding: List[float]
+    ) -> List[Dict]:
+        """Search for context chunks, reusing results for repeated query text"""
+        key = (namespace, " ".join(query.split()), n_results)
+        results = search_result_cache.get(key)
+        if results is None:
+            results = await asyncio.to_thread(
+                vector_store.search_similar,
+                query=query,
+                n_results=n_results,
+                query_embedding=query_embedding
+            )
+            # search_similar returns [] on errors too; don't let a transient
+            # failure stick to the query until the next index change
+            if results:
+                search_result_cache.set(key, results)
+        return results
+    
+    @staticmethod
+    def _exact_cache_key(namespace: str, query: str, context_chunks: List[Dict]) -> Tuple[str, str]:
+        """Build the exact-match cache key (namespace, digest of the query and retrieved chunk IDs)"""
+        chunk_ids = sorted(
+            f"{chunk['metadata'].get('document_id')}:{chunk['metadata'].get('chunk_id')}"
+            for chunk in context_chunks
+        )
+        raw_key = "|".join([namespace, query.strip().lower(), ",".join(chunk_ids)])
+        return namespace, hashlib.blake2b(raw_key.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _replay_cached_response(self, cached: Dict):
+        """Yield a cached response as streaming chunks"""
+        text = cached['response']
+        yield {
+            'type': 'start',
+            'metadata': {
+                'chunks_retrieved': cached['metadata']['chunks_retrieved'],
+                'model_used': self.model
+            }
+        }
+        for start in range(0, len(text), 64):
+            yield {'type': 'content', 'content': text[start:start + 64]}
+        yield {
+            'type': 'complete',
+            'citations': cached['citations'],
+            'metadata': {**cached['metadata'], 'cache_hit': True}
+        }
+    
+    def _fit_context(self, context_chunks: List[Dict], query: str, max_tokens: int) -> Tuple[List[Dict], int]:
+        """
+        Keep the most relevant chunks that fit in the prompt token budget
+        
+        Args:
+            context_chunks: Retrieved chunks with similarity scores
+            query: User's question
+            max_tokens: Tokens reserved for the response
+            
+        Returns:
+            Tuple of (chunks that fit, number of chunks dropped)
+        """
+        budget = (
+            settings.openai_context_tokens
+            - max_tokens
+            - self._prompt_tokens
+            - len(self.encoding.encode(query))
+        )
+        if budget <= 0:
+            raise ValueError("Question is too long for the model's context window")
+        
+        fitted = []
+        for chunk in sorted(context_chunks, key=lambda c: c['similarity_score'], reverse=True):
+            chunk_tokens = len(self.encoding.encode(chunk['content'])) + CONTEXT_CHUNK_OVERHEAD_TOKENS
+            if chunk_tokens <= budget:
+                fitted.append(chunk)
+                budget -= chunk_tokens
+        
+        dropped = len(context_chunks) - len(fitted)
+        if dropped:
+            logger.info(f"Dropped {dropped} context chunks to fit the prompt token budget")
+        return fitted, dropped
+    
+    def _fit_document_chunks(self, chunks: List[Dict], max_tokens: int) -> Tuple[List[Dict], int]:
+        """
+        Keep leading document chunks that fit in the prompt token budget
+        
+        Args:
+            chunks: Document chunks in document order
+            max_tokens: Tokens reserved for the response
+            
+        Returns:
+            Tuple of (chunks that fit in document order, their token count)
+        """
+        budget = settings.openai_context_tokens - max_tokens - DOCUMENT_PROMPT_TOKENS
+        
+        fitted = []
+        content_tokens = 0
+        for chunk in chunks:
+            chunk_tokens = len(self.encoding.encode(chunk['content']))
+            if content_tokens + chunk_tokens > budget:
+                break
+            fitted.append(chunk)
+            content_tokens += chunk_tokens
+        
+        if len(fitted) < len(chunks):
+            logger.info(f"Truncated document to {len(fitted)} of {len(chunks)} chunks to fit the prompt token budget")
+        return fitted, content_tokens
+    
     def _prepare_context(self, context_chunks: List[Dict]) -> str:
         """
         Prepare context text from retrieved chunks
@@ -259,24 +561,25 @@ User Question: {question}"""
         Returns:
             Formatted context string
         """
-        if not context_chunks:
-            return ""
-        
-        context_parts = []
+        return "".join(self._iter_context(context_chunks))
+    
+    @staticmethod
+    def _iter_context(context_chunks: List[Dict]):
+        """Yield the pieces of the formatted context, chunk by chunk"""
         for i, chunk in enumerate(context_chunks, 1):
-            metadata = chunk['metadata']
-            content = chunk['content']
-            similarity = chunk['similarity_score']
+            if i > 1:
+                yield "\n"
             
             # Format each chunk with metadata
-            chunk_text = f"""Document {i}: {metadata.get('filename', 'Unknown')}
-Relevance Score: {similarity:.3f}
-Content: {content}
-
----"""
-            context_parts.append(chunk_text)
-        
-        return "\n".join(context_parts)
+            yield "Document "
+            yield str(i)
+            yield ": "
+            yield chunk['metadata'].get('filename', 'Unknown')
+            yield "\nRelevance Score: "
+            yield f"{chunk['similarity_score']:.3f}"
+            yield "\nContent: "
+            yield chunk['content']
+            yield "\n\n---"
     
     def _prepare_citations(self, context_chunks: List[Dict]) -> List[Dict]:
         """
@@ -306,6 +609,38 @@ Content: {content}
         
         return citations
     
+    def _read_document_chunks(self, document_id: int) -> List[Dict]:
+        """
+        Read a document's leading chunks, up to what any analysis prompt can use
+        
+        Chunks are streamed from the vector store in document order, so long
+        documents are never loaded past the context window.
+        """
+        budget = settings.openai_context_tokens - DOCUMENT_PROMPT_TOKENS
+        
+        chunks = []
+        content_tokens = 0
+        try:
+            for chunk in self.vector_store.iter_document_chunks(document_id):
+                content_tokens += len(self.encoding.encode(chunk['content']))
+                if content_tokens > budget:
+                    break
+                chunks.append(chunk)
+        except Exception as e:
+            logger.error(f"Failed to get chunks for document {document_id}: {str(e)}")
+            return []
+        return chunks
+    
+    async def _get_document_chunks(self, document_id: int) -> List[Dict]:
+        """Get a document's leading chunks, reusing them across summary and keyword requests"""
+        key = (tenant_cache_prefix(self.vector_store.tenant_id), document_id)
+        chunks = document_chunks_cache.get(key)
+        if chunks is None:
+            chunks = await asyncio.to_thread(self._read_document_chunks, document_id)
+            if chunks:
+                document_chunks_cache.set(key, chunks)
+        return chunks
+    
     async def generate_summary(
         self,
         document_id: int,
@@ -323,7 +658,7 @@ Content: {content}
         """
         try:
             # Get document chunks
-            chunks = self.vector_store.get_document_chunks(document_id)
+            chunks = await self._get_document_chunks(document_id)
             
             if not chunks:
                 return {
@@ -332,38 +667,22 @@ Content: {content}
                     'metadata': {'chunks_used': 0}
                 }
             
-            # Prepare content for summarization
+            # Prepare content for summarization, truncated to the context window
+            chunks, content_tokens = self._fit_document_chunks(chunks, self._analysis_max_tokens('summary', max_length))
             content = "\n\n".join([chunk['content'] for chunk in chunks])
             
-            # Create summarization prompt
-            summary_prompt = f"""Please provide a concise summary of the following document content. Focus on the main points and key information.
-
-Document Content:
-{content}
-
-Summary (max {max_length} characters):"""
-            
-            # Generate summary
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that creates concise, accurate summaries of documents."},
-                    {"role": "user", "content": summary_prompt}
-                ],
-                temperature=0.3,  # Lower temperature for more focused summaries
-                max_tokens=max_length // 4  # Approximate token count
-            )
-            
-            summary = response.choices[0].message.content
+            # Generate summary (possibly batched with concurrent requests)
+            summary, total_tokens, batch_size = await self._analyze('summary', content, content_tokens, max_length)
             
             return {
                 'success': True,
                 'summary': summary,
                 'metadata': {
                     'chunks_used': len(chunks),
-                    'total_tokens': response.usage.total_tokens,
+                    'total_tokens': total_tokens,
                     'model_used': self.model,
-                    'summary_length': len(summary)
+                    'summary_length': len(summary),
+                    'batch_size': batch_size
                 }
             }
             
@@ -392,7 +711,7 @@ Summary (max {max_length} characters):"""
         """
         try:
             # Get document chunks
-            chunks = self.vector_store.get_document_chunks(document_id)
+            chunks = await self._get_document_chunks(document_id)
             
             if not chunks:
                 return {
@@ -401,29 +720,12 @@ Summary (max {max_length} characters):"""
                     'metadata': {'chunks_used': 0}
                 }
             
-            # Prepare content for keyword extraction
+            # Prepare content for keyword extraction, truncated to the context window
+            chunks, content_tokens = self._fit_document_chunks(chunks, self._analysis_max_tokens('keywords', max_keywords))
             content = "\n\n".join([chunk['content'] for chunk in chunks])
             
-            # Create keyword extraction prompt
-            keyword_prompt = f"""Extract the {max_keywords} most important keywords or key phrases from the following document content. Focus on terms that best represent the main topics and concepts.
-
-Document Content:
-{content}
-
-Keywords (comma-separated):"""
-            
-            # Generate keywords
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that extracts relevant keywords from documents."},
-                    {"role": "user", "content": keyword_prompt}
-                ],
-                temperature=0.2,  # Low temperature for consistent keyword extraction
-                max_tokens=200
-            )
-            
-            keywords_text = response.choices[0].message.content
+            # Generate keywords (possibly batched with concurrent requests)
+            keywords_text, total_tokens, batch_size = await self._analyze('keywords', content, content_tokens, max_keywords)
             keywords = [kw.strip() for kw in keywords_text.split(',') if kw.strip()]
             
             return {
@@ -431,9 +733,10 @@ Keywords (comma-separated):"""
                 'keywords': keywords,
                 'metadata': {
                     'chunks_used': len(chunks),
-                    'total_tokens': response.usage.total_tokens,
+                    'total_tokens': total_tokens,
                     'model_used': self.model,
-                    'keywords_count': len(keywords)
+                    'keywords_count': len(keywords),
+                    'batch_size': batch_size
                 }
             }
             
@@ -445,6 +748,161 @@ Keywords (comma-separated):"""
                 'metadata': {'error': str(e)}
             }
     
+    async def _analyze(self, kind: str, content: str, content_tokens: int, limit: int) -> Tuple[str, int, int]:
+        """
+        Queue a summary or keyword request for the batching worker
+        
+        Args:
+            kind: 'summary' or 'keywords'
+            content: Document content to analyze
+            content_tokens: Token count of the content
+            limit: Maximum summary length or number of keywords
+            
+        Returns:
+            Tuple of (result text, total tokens of the call, number of documents in the call)
+        """
+        if self._analysis_queue is None:
+            self._analysis_queue = asyncio.Queue()
+            self._analysis_worker = asyncio.create_task(self._run_analysis_worker())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._analysis_queue.put((kind, content, content_tokens, limit, future))
+        return await future
+    
+    async def _run_analysis_worker(self):
+        """Collect concurrent analysis requests into batches and dispatch them"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._analysis_queue.get()]
+            deadline = loop.time() + ANALYSIS_BATCH_WINDOW
+            while len(batch) < ANALYSIS_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._analysis_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Each analysis type has its own prompt, so batch them separately
+            for kind in ('summary', 'keywords'):
+                jobs = [job for job in batch if job[0] == kind]
+                if jobs:
+                    task = asyncio.create_task(self._run_analysis_batch(kind, jobs))
+                    self._analysis_tasks.add(task)
+                    task.add_done_callback(self._analysis_tasks.discard)
+    
+    async def _run_analysis_batch(self, kind: str, jobs: List[Tuple]):
+        """Run a batch of analysis jobs and resolve their futures"""
+        batch_tokens = sum(job[2] for job in jobs) + sum(self._analysis_max_tokens(kind, job[3]) for job in jobs)
+        if len(jobs) > 1 and batch_tokens + DOCUMENT_PROMPT_TOKENS <= settings.openai_context_tokens:
+            try:
+                results, total_tokens = await self._analyze_batch(kind, jobs)
+                for job, result in zip(jobs, results):
+                    if not job[4].done():
+                        job[4].set_result((result, total_tokens, len(jobs)))
+                return
+            except Exception as e:
+                logger.warning(f"Batched {kind} request failed, falling back to single requests: {str(e)}")
+        
+        async def run_single(job):
+            try:
+                result, total_tokens = await self._analyze_single(kind, job[1], job[3])
+                if not job[4].done():
+                    job[4].set_result((result, total_tokens, 1))
+            except Exception as e:
+                if not job[4].done():
+                    job[4].set_exception(e)
+        
+        await asyncio.gather(*(run_single(job) for job in jobs))
+    
+    @staticmethod
+    def _analysis_max_tokens(kind: str, limit: int) -> int:
+        """Response token limit for one document's analysis"""
+        return limit // 4 if kind == 'summary' else 200
+    
+    async def _analyze_single(self, kind: str, content: str, limit: int) -> Tuple[str, int]:
+        """Summarize or extract keywords from one document"""
+        if kind == 'summary':
+            system_message = "You are a helpful assistant that creates concise, accurate summaries of documents."
+            prompt = f"""Please provide a concise summary of the following document content. Focus on the main points and key information.
+
+Document Content:
+{content}
+
+Summary (max {limit} characters):"""
+            temperature = 0.3  # Lower temperature for more focused summaries
+        else:
+            system_message = "You are a helpful assistant that extracts relevant keywords from documents."
+            prompt = f"""Extract the {limit} most important keywords or key phrases from the following document content. Focus on terms that best represent the main topics and concepts.
+
+Document Content:
+{content}
+
+Keywords (comma-separated):"""
+            temperature = 0.2  # Low temperature for consistent keyword extraction
+        
+        response = await self._create_completion(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            max_tokens=self._analysis_max_tokens(kind, limit)
+        )
+        
+        return response.choices[0].message.content, response.usage.total_tokens
+    
+    async def _analyze_batch(self, kind: str, jobs: List[Tuple]) -> Tuple[List[str], int]:
+        """Summarize or extract keywords from several documents in one call"""
+        if kind == 'summary':
+            system_message = (
+                "You are a helpful assistant that creates concise, accurate summaries of documents. "
+                'Respond with a JSON object of the form {"results": [...]} containing one summary string per document, in order.'
+            )
+            instructions = "Please provide a concise summary of each of the following documents. Focus on the main points and key information."
+            headers = [f"Document {i} (summary max {job[3]} characters)" for i, job in enumerate(jobs, 1)]
+            temperature = 0.3
+        else:
+            system_message = (
+                "You are a helpful assistant that extracts relevant keywords from documents. "
+                'Respond with a JSON object of the form {"results": [...]} containing one comma-separated keyword string per document, in order.'
+            )
+            instructions = "Extract the most important keywords or key phrases from each of the following documents. Focus on terms that best represent the main topics and concepts."
+            headers = [f"Document {i} ({job[3]} keywords)" for i, job in enumerate(jobs, 1)]
+            temperature = 0.2
+        
+        prompt = "\n\n".join([instructions] + [
+            f"{header}:\n{job[1]}" for header, job in zip(headers, jobs)
+        ])
+        
+        response = await self._create_completion(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            max_tokens=sum(self._analysis_max_tokens(kind, job[3]) for job in jobs),
+            response_format={"type": "json_object"}
+        )
+        
+        results = json.loads(response.choices[0].message.content)['results']
+        if len(results) != len(jobs) or not all(isinstance(result, str) for result in results):
+            raise ValueError(f"Expected {len(jobs)} results, got {len(results)}")
+        
+        return results, response.usage.total_tokens
+    
+    async def close(self):
+        """Stop the analysis batching worker and close the HTTP client"""
+        if self._analysis_worker:
+            self._analysis_worker.cancel()
+            await asyncio.gather(self._analysis_worker, return_exceptions=True)
+            self._analysis_worker = None
+            self._analysis_queue = None
+        await self.client.close()
+    
     async def test_connection(self) -> Dict:
         """
         Test OpenAI API connection
@@ -471,4 +929,23 @@ Keywords (comma-separated):"""
                 'success': False,
                 'status': 'Failed',
                 'error': str(e)
-            } 
\ No newline at end of file
+            }
+
+# Dependency for getting the application-wide LLM service
+def get_llm_service(request: Request) -> Optional[LLMService]:
+    """Get the shared LLM service (None if OpenAI is not configured)"""
+    return request.app.state.llm_service
+
+# Fixed bytes around the text of a streamed content event
+SSE_CONTENT_PREFIX = b'data: {"type":"content","content":'
+SSE_CONTENT_SUFFIX = b'}\n\n'
+
+def format_sse(chunk: Dict) -> bytes:
+    """Format a streaming chunk as a server-sent event"""
+    if chunk['type'] == 'content':
+        return format_sse_content(chunk['content'])
+    return b"data: " + orjson.dumps(chunk) + b"\n\n"
+
+def format_sse_content(text: str) -> bytes:
+    """Format streamed response text as a content event, encoding only the text"""
+    return SSE_CONTENT_PREFIX + orjson.dumps(text) + SSE_CONTENT_SUFFIX
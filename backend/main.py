@@ -2,18 +2,42 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import uvicorn
+import logging
 from contextlib import asynccontextmanager
-from database import engine, Base
+from anyio import to_thread
+from database import engine, async_engine, Base
 from routers import chat, documents, health, llm, tenants
-from config import settings
+from config import settings, prepare_storage
+from ingestion import ingestion_queue
+from message_writer import chat_message_writer
+from llm_service import LLMService
+
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    prepare_storage()
+    # Size the threadpool that runs sync endpoints
+    to_thread.current_default_thread_limiter().total_tokens = settings.thread_pool_size
     Base.metadata.create_all(bind=engine)
+    await ingestion_queue.start()
+    
+    # Share one LLM service (and its HTTP connection pool) across requests
+    try:
+        app.state.llm_service = LLMService()
+    except ValueError as e:
+        logger.warning(f"LLM service unavailable: {e}")
+        app.state.llm_service = None
+    
     yield
     # Shutdown
-    pass
+    if app.state.llm_service:
+        await app.state.llm_service.close()
+    await ingestion_queue.stop()
+    documents.processor.close()
+    await chat_message_writer.stop()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Doc Query API",
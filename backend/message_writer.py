@@ -0,0 +1,148 @@
+"""
+Batched Chat Message Persistence for Doc Query
+
+Collects chat messages written by concurrent requests and stores them with
+one multi-row INSERT per batch, so a burst of messages shares a single
+commit instead of paying for one transaction each. Sessions started by a
+message are created in the same transaction.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from sqlalchemy import insert
+from database import AsyncSessionLocal, ChatMessage, ChatSession
+
+logger = logging.getLogger(__name__)
+
+# How long the writer waits for more messages before flushing a batch
+WRITE_BATCH_WINDOW = 0.01
+
+# Maximum number of messages stored by one INSERT
+WRITE_BATCH_SIZE = 100
+
+class ChatMessageWriter:
+    """Micro-batches chat message inserts across concurrent requests"""
+
+    def __init__(self, batch_window: float = WRITE_BATCH_WINDOW, max_batch_size: int = WRITE_BATCH_SIZE):
+        """
+        Initialize message writer
+
+        Args:
+            batch_window: Seconds to wait for more messages before writing
+            max_batch_size: Maximum number of messages per INSERT
+        """
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        # Pending messages per tenant, drained in turn so one busy tenant can't starve the rest
+        self._pending: "OrderedDict[str, Deque[Tuple[Dict, bool, asyncio.Future]]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def save(self, tenant_id: str, session_id: str, message: str, response: str, new_session: bool = False) -> int:
+        """
+        Queue a chat message for the next batch
+
+        Args:
+            tenant_id: Tenant that owns the message
+            session_id: Chat session ID
+            message: User message
+            response: Assistant response
+            new_session: Create the chat session in the same transaction
+
+        Returns:
+            ID of the stored message
+        """
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        row = {
+            "tenant_id": tenant_id,
+            "session_id": session_id,
+            "message": message,
+            "response": response
+        }
+        self._pending.setdefault(tenant_id, deque()).append((row, new_session, future))
+        self._wakeup.set()
+        return await future
+
+    async def stop(self):
+        """Write any queued messages and stop the writer task"""
+        if self._worker:
+            self._closing = True
+            self._wakeup.set()
+            await self._worker
+            self._worker = None
+            self._wakeup = None
+            self._closing = False
+
+    async def _run(self):
+        """Wait for queued messages and write them in batches"""
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._closing:
+                await asyncio.sleep(self.batch_window)
+
+            while self._pending:
+                await self._flush(self._take_batch())
+
+    def _take_batch(self) -> List[Tuple[Dict, bool, asyncio.Future]]:
+        """Take up to max_batch_size queued messages, one tenant at a time"""
+        batch = []
+        while self._pending and len(batch) < self.max_batch_size:
+            tenant_id, queue = self._pending.popitem(last=False)
+            batch.append(queue.popleft())
+            if queue:
+                # Back of the line until the other tenants have had a turn
+                self._pending[tenant_id] = queue
+        return batch
+
+    async def _flush(self, batch: List[Tuple[Dict, bool, asyncio.Future]]):
+        """Insert a batch of messages and resolve their futures with the new IDs"""
+        try:
+            message_ids = await self._write(batch)
+        except Exception as e:
+            if len(batch) > 1:
+                # One bad row fails the whole transaction; retry each message
+                # on its own so only the failing caller gets the error
+                logger.warning(f"Chat message batch failed, retrying individually: {str(e)}")
+                for entry in batch:
+                    await self._flush([entry])
+                return
+
+            logger.error(f"Failed to store chat message: {str(e)}")
+            _, _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        for (_, _, future), message_id in zip(batch, message_ids):
+            # Skip callers that went away (e.g. a closed stream)
+            if not future.done():
+                future.set_result(message_id)
+
+    @staticmethod
+    async def _write(batch: List[Tuple[Dict, bool, asyncio.Future]]) -> List[int]:
+        """Insert a batch of messages (and new sessions) in one transaction"""
+        sessions = [
+            {"tenant_id": row["tenant_id"], "session_id": row["session_id"]}
+            for row, new_session, _ in batch if new_session
+        ]
+        async with AsyncSessionLocal() as db:
+            if sessions:
+                await db.execute(insert(ChatSession), sessions)
+            result = await db.execute(
+                insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True),
+                [row for row, _, _ in batch]
+            )
+            message_ids = result.scalars().all()
+            await db.commit()
+        return message_ids
+
+# Shared writer used by the chat endpoints
+chat_message_writer = ChatMessageWriter()
@@ -1,17 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, func, select, update
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 from datetime import datetime, timedelta
 import uuid
-import json
-from database import get_db, ChatMessage, ChatSession
+from database import get_db, get_async_db, ChatMessage, ChatSession
+from message_writer import chat_message_writer
 from tenant_middleware import get_tenant_id, get_tenant_context, TenantContext
 from tenant_provisioning import TenantProvisioning
+from llm_service import LLMService, get_llm_service, format_sse, format_sse_content
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Stored values for each feedback option
+FEEDBACK_VALUES = {'positive': 1, 'negative': -1}
 
 # Pydantic models
 class ChatRequest(BaseModel):
@@ -61,36 +66,43 @@ class FeedbackTrendResponse(BaseModel):
 @router.post("/send", response_model=ChatResponse)
 async def send_message(
     request: ChatRequest,
-    db: Session = Depends(get_db),
-    tenant_id: str = Depends(get_tenant_id)
+    db: AsyncSession = Depends(get_async_db),
+    tenant_context: TenantContext = Depends(get_tenant_context),
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
 ):
     """Send a chat message and get response"""
+    tenant_id = tenant_context.tenant_id
+    
     # Check tenant limits for chat messages
-    if not TenantProvisioning.check_tenant_limits(db, tenant_id, "chat_messages", 1):
+    within_limits = await db.run_sync(
+        TenantProvisioning.check_tenant_limits, tenant_context.tenant, "chat_messages", 1
+    )
+    if not within_limits:
         raise HTTPException(
             status_code=400,
             detail="Chat message limit exceeded for this tenant"
         )
     
-    # Generate session ID if not provided
-    if not request.session_id:
+    # Generate session ID if not provided; the session is created along with the message
+    new_session = not request.session_id
+    if new_session:
         session_id = str(uuid.uuid4())
-        # Create new session
-        new_session = ChatSession(tenant_id=tenant_id, session_id=session_id)
-        db.add(new_session)
-        db.commit()
     else:
         session_id = request.session_id
         # Update session timestamp
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id, ChatSession.tenant_id == tenant_id).first()
-        if session:
-            session.updated_at = datetime.utcnow()
-            db.commit()
+        result = await db.execute(
+            update(ChatSession)
+            .where(ChatSession.session_id == session_id, ChatSession.tenant_id == tenant_id)
+            .values(updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Session not found")
+        await db.commit()
     
     # Use RAG processing for the response
     try:
-        from llm_service import LLMService
-        llm_service = LLMService()
+        if llm_service is None:
+            raise ValueError("OpenAI API key not configured")
         
         # Generate RAG response with tenant context
         result = await llm_service.generate_rag_response(
@@ -106,68 +118,66 @@ async def send_message(
             response_text = f"Sorry, I couldn't process your request: {result.get('error', 'Unknown error')}"
             citations = []
             
-    except ImportError:
-        # For testing purposes, return a mock response
-        response_text = f"Mock response for tenant {tenant_id}: {request.message}"
-        citations = []
     except Exception as e:
         # For testing purposes, return a mock response on any error
         response_text = f"Mock response for tenant {tenant_id}: {request.message}"
         citations = []
     
-            # Save message to database
-    chat_message = ChatMessage(
-        tenant_id=tenant_id,
-        session_id=session_id,
-        message=request.message,
-        response=response_text
-    )
-    db.add(chat_message)
-    db.commit()
-    db.refresh(chat_message)
+    # Save message to database (batched with concurrent writes)
+    message_id = await chat_message_writer.save(tenant_id, session_id, request.message, response_text, new_session)
     
     return ChatResponse(
         response=response_text,
         session_id=session_id,
-        message_id=chat_message.id,
+        message_id=message_id,
         citations=citations
     )
 
 @router.post("/send/stream")
 async def send_message_stream(
     request: ChatRequest,
-    db: Session = Depends(get_db),
-    tenant_id: str = Depends(get_tenant_id)
+    db: AsyncSession = Depends(get_async_db),
+    tenant_context: TenantContext = Depends(get_tenant_context),
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
 ):
     """Send a chat message and get streaming response with persistence"""
+    tenant_id = tenant_context.tenant_id
+    
     # Check tenant limits for chat messages
-    if not TenantProvisioning.check_tenant_limits(db, tenant_id, "chat_messages", 1):
+    within_limits = await db.run_sync(
+        TenantProvisioning.check_tenant_limits, tenant_context.tenant, "chat_messages", 1
+    )
+    if not within_limits:
         raise HTTPException(
             status_code=400,
             detail="Chat message limit exceeded for this tenant"
         )
     
-    # Generate session ID if not provided
-    if not request.session_id:
+    # Generate session ID if not provided; the session is created along with the message
+    new_session = not request.session_id
+    if new_session:
         session_id = str(uuid.uuid4())
-        # Create new session
-        new_session = ChatSession(tenant_id=tenant_id, session_id=session_id)
-        db.add(new_session)
-        db.commit()
     else:
         session_id = request.session_id
         # Update session timestamp
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id, ChatSession.tenant_id == tenant_id).first()
-        if session:
-            session.updated_at = datetime.utcnow()
-            db.commit()
+        result = await db.execute(
+            update(ChatSession)
+            .where(ChatSession.session_id == session_id, ChatSession.tenant_id == tenant_id)
+            .values(updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Session not found")
+        await db.commit()
     
     async def generate_stream():
-        full_response = ""
+        response_parts = []
+        # Set once the message has been handed to the writer, so a failed
+        # save isn't retried (and the new session inserted twice) below
+        save_attempted = False
         
         try:
-            from llm_service import LLMService
-            llm_service = LLMService()
+            if llm_service is None:
+                raise ValueError("OpenAI API key not configured")
             
             # Generate streaming RAG response with tenant context
             async for chunk in llm_service.generate_streaming_rag_response(
@@ -176,61 +186,51 @@ async def send_message_stream(
                 tenant_id=tenant_id
             ):
                 if chunk['type'] == 'content':
-                    full_response += chunk['content']
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    response_parts.append(chunk['content'])
+                    yield format_sse_content(chunk['content'])
+                elif chunk['type'] == 'start':
+                    yield format_sse(chunk)
                 elif chunk['type'] == 'complete':
                     # Save the complete message to database
-                    chat_message = ChatMessage(
-                        tenant_id=tenant_id,
-                        session_id=session_id,
-                        message=request.message,
-                        response=chunk['content']
+                    save_attempted = True
+                    message_id = await chat_message_writer.save(
+                        tenant_id, session_id, request.message, "".join(response_parts), new_session
                     )
-                    db.add(chat_message)
-                    db.commit()
                     
                     # Send final chunk with session info and citations
                     final_chunk = {
                         'type': 'complete',
-                        'content': chunk['content'],
                         'session_id': session_id,
-                        'message_id': chat_message.id,
+                        'message_id': message_id,
                         'citations': chunk.get('citations', [])
                     }
-                    yield f"data: {json.dumps(final_chunk)}\n\n"
+                    yield format_sse(final_chunk)
                     break
                 elif chunk['type'] == 'error':
-                    # Save error message to database
-                    chat_message = ChatMessage(
-                        tenant_id=tenant_id,
-                        session_id=session_id,
-                        message=request.message,
-                        response=chunk['content']
-                    )
-                    db.add(chat_message)
-                    db.commit()
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    # Send the error first; its frame does not need the message ID
+                    yield format_sse(chunk)
+                    save_attempted = True
+                    await chat_message_writer.save(tenant_id, session_id, request.message, chunk['content'], new_session)
                     break
                     
         except Exception as e:
             error_message = f"Sorry, I encountered an error: {str(e)}"
-            # Save error message to database
-            chat_message = ChatMessage(
-                tenant_id=tenant_id,
-                session_id=session_id,
-                message=request.message,
-                response=error_message
-            )
-            db.add(chat_message)
-            db.commit()
+            message_id = None
+            if not save_attempted:
+                # Save error message to database; the error frame is sent
+                # even if that fails too (the writer logs the failure)
+                try:
+                    message_id = await chat_message_writer.save(tenant_id, session_id, request.message, error_message, new_session)
+                except Exception:
+                    pass
             
             error_chunk = {
                 'type': 'error',
                 'content': error_message,
                 'session_id': session_id,
-                'message_id': chat_message.id
+                'message_id': message_id
             }
-            yield f"data: {json.dumps(error_chunk)}\n\n"
+            yield format_sse(error_chunk)
     
     return StreamingResponse(
         generate_stream(),
@@ -244,38 +244,57 @@ async def send_message_stream(
 
 @router.get("/sessions", response_model=List[ChatSessionResponse])
 async def get_chat_sessions(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Get all chat sessions"""
-    sessions = db.query(ChatSession).filter(ChatSession.tenant_id == tenant_id).all()
-    result = []
-    
-    for session in sessions:
-        message_count = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session.session_id
-        ).count()
-        
-        result.append(ChatSessionResponse(
-            session_id=session.session_id,
-            created_at=session.created_at,
-            updated_at=session.updated_at,
-            message_count=message_count
-        ))
+    # Load sessions with their message counts in a single query
+    rows = (await db.execute(
+        select(
+            ChatSession.session_id,
+            ChatSession.created_at,
+            ChatSession.updated_at,
+            func.count(ChatMessage.id).label("message_count")
+        )
+        .outerjoin(
+            ChatMessage,
+            (ChatMessage.session_id == ChatSession.session_id)
+            & (ChatMessage.tenant_id == ChatSession.tenant_id)
+        )
+        .where(ChatSession.tenant_id == tenant_id)
+        .group_by(ChatSession.id)
+    )).all()
     
-    return result
+    return [
+        ChatSessionResponse(
+            session_id=row.session_id,
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+            message_count=row.message_count
+        )
+        for row in rows
+    ]
 
 @router.get("/sessions/{session_id}/messages", response_model=List[ChatMessageResponse])
 async def get_session_messages(
     session_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Get all messages for a specific session"""
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id,
-        ChatMessage.tenant_id == tenant_id
-    ).order_by(ChatMessage.created_at).all()
+    # Select only the response columns; plain rows skip ORM hydration
+    messages = (await db.execute(
+        select(
+            ChatMessage.id,
+            ChatMessage.message,
+            ChatMessage.response,
+            ChatMessage.created_at,
+            ChatMessage.feedback
+        ).where(
+            ChatMessage.session_id == session_id,
+            ChatMessage.tenant_id == tenant_id
+        ).order_by(ChatMessage.created_at)
+    )).all()
     
     return [
         ChatMessageResponse(
@@ -292,37 +311,44 @@ async def get_session_messages(
 async def submit_feedback(
     message_id: int,
     request: FeedbackRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Submit feedback for a chat message"""
     # Convert string feedback to integer
-    feedback_value = 1 if request.feedback == 'positive' else -1 if request.feedback == 'negative' else None
+    feedback_value = FEEDBACK_VALUES.get(request.feedback)
     
     if feedback_value is None:
         raise HTTPException(status_code=400, detail="Feedback must be 'positive' or 'negative'")
     
-    message = db.query(ChatMessage).filter(ChatMessage.id == message_id, ChatMessage.tenant_id == tenant_id).first()
-    if not message:
+    result = await db.execute(
+        update(ChatMessage)
+        .where(ChatMessage.id == message_id, ChatMessage.tenant_id == tenant_id)
+        .values(feedback=feedback_value)
+    )
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Message not found")
     
-    message.feedback = feedback_value
-    db.commit()
+    await db.commit()
     
     return {"message": "Feedback submitted successfully"} 
 
 @router.get("/feedback/stats", response_model=FeedbackStatsResponse)
 async def get_feedback_stats(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Get aggregated feedback statistics"""
-    # Get total messages
-    total_messages = db.query(ChatMessage).filter(ChatMessage.tenant_id == tenant_id).count()
-    
-    # Get feedback counts
-    positive_feedback = db.query(ChatMessage).filter(ChatMessage.feedback == 1, ChatMessage.tenant_id == tenant_id).count()
-    negative_feedback = db.query(ChatMessage).filter(ChatMessage.feedback == -1, ChatMessage.tenant_id == tenant_id).count()
+    # Get total messages and feedback counts in a single pass. COUNT(*) keeps
+    # every referenced column inside the (tenant_id, created_at, feedback)
+    # index, so the scan can be index-only.
+    total_messages, positive_feedback, negative_feedback = (await db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(case((ChatMessage.feedback == 1, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((ChatMessage.feedback == -1, 1), else_=0)), 0)
+        ).where(ChatMessage.tenant_id == tenant_id)
+    )).one()
     no_feedback = total_messages - positive_feedback - negative_feedback
     
     # Calculate percentages
@@ -351,33 +377,37 @@ async def get_feedback_stats(
 @router.get("/feedback/trends", response_model=List[FeedbackTrendResponse])
 async def get_feedback_trends(
     days: int = 30,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Get feedback trends over time"""
-    trends = []
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = today - timedelta(days=days - 1)
+    
+    # Aggregate feedback per day in a single query
+    day = func.date(ChatMessage.created_at).label('day')
+    rows = (await db.execute(
+        select(
+            day,
+            func.sum(case((ChatMessage.feedback == 1, 1), else_=0)),
+            func.sum(case((ChatMessage.feedback == -1, 1), else_=0)),
+            func.count()
+        )
+        .where(ChatMessage.tenant_id == tenant_id, ChatMessage.created_at >= start_date)
+        .group_by(day)
+    )).all()
+    counts = {str(row[0]): row[1:] for row in rows}
     
+    # Fill in days without messages, in chronological order
+    trends = []
     for i in range(days):
-        date = datetime.utcnow() - timedelta(days=i)
-        start_date = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_date = start_date + timedelta(days=1)
-        
-        # Get messages for this date
-        messages = db.query(ChatMessage).filter(
-            ChatMessage.created_at >= start_date,
-            ChatMessage.created_at < end_date
-        ).all()
-        
-        positive = sum(1 for msg in messages if msg.feedback == 1)
-        negative = sum(1 for msg in messages if msg.feedback == -1)
-        total = len(messages)
-        
+        date = (start_date + timedelta(days=i)).strftime('%Y-%m-%d')
+        positive, negative, total = counts.get(date, (0, 0, 0))
         trends.append(FeedbackTrendResponse(
-            date=start_date.strftime('%Y-%m-%d'),
+            date=date,
             positive=positive,
             negative=negative,
             total=total
         ))
     
-    # Reverse to get chronological order
-    return list(reversed(trends)) 
\ No newline at end of file
+    return trends
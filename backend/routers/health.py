@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from database import get_db
+from fastapi import APIRouter
+from sqlalchemy import text
+import time
+from database import health_engine
 from config import settings
 
 router = APIRouter()
 
+# How long a database check result is reused
+DB_CHECK_TTL_SECONDS = 1.0
+_last_db_check = (0.0, "")
+
 @router.get("/health")
 async def health_check():
     """Basic health check endpoint"""
@@ -14,16 +19,30 @@ async def health_check():
         "version": "1.0.0"
     }
 
-@router.get("/health/detailed")
-async def detailed_health_check(db: Session = Depends(get_db)):
-    """Detailed health check with database connectivity"""
+def _check_database() -> str:
+    """Check database connectivity, reusing a recent result"""
+    global _last_db_check
+    checked_at, db_status = _last_db_check
+    now = time.monotonic()
+    if now - checked_at < DB_CHECK_TTL_SECONDS:
+        return db_status
+    
     try:
-        # Test database connection
-        db.execute("SELECT 1")
+        with health_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
         db_status = "connected"
     except Exception as e:
         db_status = f"error: {str(e)}"
     
+    _last_db_check = (now, db_status)
+    return db_status
+
+@router.get("/health/detailed")
+def detailed_health_check():
+    """Detailed health check with database connectivity"""
+    # Sync handler: the blocking database check runs in the threadpool
+    db_status = _check_database()
+    
     return {
         "status": "healthy",
         "service": "Doc Query API",
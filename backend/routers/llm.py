@@ -5,18 +5,24 @@ Handles RAG queries, streaming responses, document analysis,
 and LLM service management.
 """
 
-import json
 import logging
-from typing import Optional
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import StreamingResponse
+import time
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from database import get_db
-from llm_service import LLMService
+from llm_service import LLMService, get_llm_service, format_sse
+from http_cache import cached_json_response
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# System message for chat without document context
+SIMPLE_CHAT_SYSTEM_MESSAGE = {"role": "system", "content": "You are Doc Query, a helpful document assistant."}
+
+# The OpenAI model list rarely changes, so it's fetched at most this often
+MODELS_CACHE_TTL_SECONDS = 600
+_models_cache = (0.0, [])
 
 # Request/Response models
 class RAGQueryRequest(BaseModel):
@@ -29,7 +35,7 @@ class RAGQueryRequest(BaseModel):
 class RAGQueryResponse(BaseModel):
     success: bool
     response: str
-    context_used: list
+    citations: list = []
     metadata: dict
 
 class DocumentAnalysisRequest(BaseModel):
@@ -52,11 +58,12 @@ class LLMStatusResponse(BaseModel):
 @router.post("/query", response_model=RAGQueryResponse)
 async def rag_query(
     request: RAGQueryRequest,
-    db: Session = Depends(get_db)
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
 ):
     """Generate RAG response using document context"""
     try:
-        llm_service = LLMService()
+        if llm_service is None:
+            raise ValueError("OpenAI API key not configured")
         
         result = await llm_service.generate_rag_response(
             query=request.query,
@@ -69,7 +76,7 @@ async def rag_query(
         return RAGQueryResponse(
             success=result['success'],
             response=result['response'],
-            context_used=result['context_used'],
+            citations=result.get('citations', []),
             metadata=result['metadata']
         )
         
@@ -80,11 +87,12 @@ async def rag_query(
 @router.post("/query/stream")
 async def rag_query_stream(
     request: RAGQueryRequest,
-    db: Session = Depends(get_db)
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
 ):
     """Generate streaming RAG response"""
     try:
-        llm_service = LLMService()
+        if llm_service is None:
+            raise ValueError("OpenAI API key not configured")
         
         async def generate_stream():
             async for chunk in llm_service.generate_streaming_rag_response(
@@ -94,7 +102,7 @@ async def rag_query_stream(
                 temperature=request.temperature,
                 max_tokens=request.max_tokens
             ):
-                yield f"data: {json.dumps(chunk)}\n\n"
+                yield format_sse(chunk)
         
         return StreamingResponse(
             generate_stream(),
@@ -113,11 +121,13 @@ async def rag_query_stream(
 @router.post("/analyze", response_model=DocumentAnalysisResponse)
 async def analyze_document(
     request: DocumentAnalysisRequest,
-    db: Session = Depends(get_db)
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
 ):
     """Analyze document (summary or keywords)"""
     try:
-        llm_service = LLMService()
+        # Use the shared service so concurrent analyses can be batched
+        if llm_service is None:
+            raise ValueError("OpenAI API key not configured")
         
         if request.analysis_type == "summary":
             result = await llm_service.generate_summary(
@@ -154,18 +164,27 @@ async def analyze_document(
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 @router.get("/status", response_model=LLMStatusResponse)
-async def get_llm_status():
+async def get_llm_status(
+    request: Request,
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
+):
     """Test LLM service connection and status"""
     try:
-        llm_service = LLMService()
+        if llm_service is None:
+            raise ValueError("OpenAI API key not configured")
         result = await llm_service.test_connection()
         
-        return LLMStatusResponse(
+        status = LLMStatusResponse(
             success=result['success'],
             status=result['status'],
             model=result.get('model'),
             error=result.get('error')
         )
+        if not status.success:
+            return status
+        
+        # Polled by dashboards; let proxies answer repeat polls for a while
+        return cached_json_response(request, status.model_dump(), max_age=30)
         
     except Exception as e:
         logger.error(f"LLM status check failed: {str(e)}")
@@ -178,17 +197,18 @@ async def get_llm_status():
 @router.post("/chat/simple")
 async def simple_chat(
     request: RAGQueryRequest,
-    db: Session = Depends(get_db)
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
 ):
     """Simple chat without RAG (for testing)"""
     try:
-        llm_service = LLMService()
+        if llm_service is None:
+            raise ValueError("OpenAI API key not configured")
         
         # Simple chat without document context
         response = await llm_service.client.chat.completions.create(
             model=llm_service.model,
             messages=[
-                {"role": "system", "content": "You are Doc Query, a helpful document assistant."},
+                SIMPLE_CHAT_SYSTEM_MESSAGE,
                 {"role": "user", "content": request.query}
             ],
             temperature=request.temperature,
@@ -211,31 +231,55 @@ async def simple_chat(
         logger.error(f"Simple chat failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
+async def _get_chat_models(llm_service: LLMService) -> List[dict]:
+    """Get the chat models available to the API key, cached for a while"""
+    global _models_cache
+    expires_at, chat_models = _models_cache
+    if time.monotonic() < expires_at:
+        return chat_models
+    
+    # List available models
+    models = await llm_service.client.models.list()
+    
+    # Filter for chat models
+    chat_models = [
+        {
+            'id': model.id,
+            'name': model.id,
+            'type': 'chat'
+        }
+        for model in models.data
+        if 'gpt' in model.id.lower()
+    ]
+    
+    _models_cache = (time.monotonic() + MODELS_CACHE_TTL_SECONDS, chat_models)
+    return chat_models
+
 @router.get("/models")
-async def get_available_models():
+async def get_available_models(
+    request: Request,
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
+):
     """Get available OpenAI models"""
     try:
-        llm_service = LLMService()
+        if llm_service is None:
+            raise ValueError("OpenAI API key not configured")
         
-        # List available models
-        models = await llm_service.client.models.list()
-        
-        # Filter for chat models
-        chat_models = [
-            {
-                'id': model.id,
-                'name': model.id,
-                'type': 'chat'
-            }
-            for model in models.data
-            if 'gpt' in model.id.lower()
-        ]
-        
-        return {
-            'models': chat_models,
+        return cached_json_response(request, {
+            'models': await _get_chat_models(llm_service),
             'current_model': llm_service.model
-        }
+        }, max_age=900)
         
     except Exception as e:
         logger.error(f"Failed to get models: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to get models: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to get models: {str(e)}")
+
+@router.post("/models/refresh")
+async def refresh_available_models(
+    request: Request,
+    llm_service: Optional[LLMService] = Depends(get_llm_service)
+):
+    """Drop the cached model list and fetch it again"""
+    global _models_cache
+    _models_cache = (0.0, [])
+    return await get_available_models(request, llm_service)
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from database import get_db, Tenant
@@ -6,9 +7,12 @@ from tenant_provisioning import TenantProvisioning
 from tenant_middleware import get_tenant_context, get_tenant_id, TenantContext, TenantMiddleware, security
 from pydantic import BaseModel
 from typing import Optional, List
-import json
+from config import settings
+import logging
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
+
+router = APIRouter(default_response_class=ORJSONResponse)
 
 # Pydantic models for request/response
 class TenantCreate(BaseModel):
@@ -55,8 +59,29 @@ class TenantUsageResponse(BaseModel):
     usage: dict
     features_enabled: List[str]
 
+def _tenant_to_dict(tenant) -> dict:
+    """Build the TenantResponse fields for a tenant (model or column row) as a plain dict"""
+    return {
+        "id": tenant.id,
+        "name": tenant.name,
+        "domain": tenant.domain,
+        "api_key": tenant.api_key,
+        "created_at": tenant.created_at,
+        "updated_at": tenant.updated_at,
+        "is_active": tenant.is_active,
+        "max_documents": tenant.max_documents,
+        "max_chat_messages": tenant.max_chat_messages,
+        "max_storage_mb": tenant.max_storage_mb,
+        "features_enabled": tenant.features_enabled
+    }
+
+# Handlers return ORJSONResponse directly; the response models document the
+# shapes without FastAPI re-validating and re-encoding every field.
+# They only make blocking database calls, so they are plain functions that
+# FastAPI runs in its threadpool instead of on the event loop
+
 @router.post("/", response_model=TenantResponse, status_code=status.HTTP_201_CREATED)
-async def create_tenant(
+def create_tenant(
     tenant_data: TenantCreate,
     db: Session = Depends(get_db)
 ):
@@ -98,19 +123,7 @@ async def create_tenant(
             features_enabled=tenant_data.features_enabled
         )
         
-        return TenantResponse(
-            id=tenant.id,
-            name=tenant.name,
-            domain=tenant.domain,
-            api_key=tenant.api_key,
-            created_at=tenant.created_at.isoformat(),
-            updated_at=tenant.updated_at.isoformat(),
-            is_active=tenant.is_active,
-            max_documents=tenant.max_documents,
-            max_chat_messages=tenant.max_chat_messages,
-            max_storage_mb=tenant.max_storage_mb,
-            features_enabled=json.loads(tenant.features_enabled) if tenant.features_enabled else []
-        )
+        return ORJSONResponse(_tenant_to_dict(tenant), status_code=status.HTTP_201_CREATED)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -118,59 +131,34 @@ async def create_tenant(
         )
 
 @router.get("/", response_model=List[TenantResponse])
-async def list_tenants(
+def list_tenants(
     active_only: bool = True,
+    last_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     db: Session = Depends(get_db)
 ):
-    """List all tenants"""
-    tenants = TenantProvisioning.list_tenants(db, active_only=active_only)
+    """List tenants, paginated by passing the last tenant ID of the previous page as last_id"""
+    tenants = TenantProvisioning.list_tenants(db, active_only=active_only, last_id=last_id, limit=limit)
     
-    return [
-        TenantResponse(
-            id=tenant.id,
-            name=tenant.name,
-            domain=tenant.domain,
-            api_key=tenant.api_key,
-            created_at=tenant.created_at.isoformat(),
-            updated_at=tenant.updated_at.isoformat(),
-            is_active=tenant.is_active,
-            max_documents=tenant.max_documents,
-            max_chat_messages=tenant.max_chat_messages,
-            max_storage_mb=tenant.max_storage_mb,
-            features_enabled=json.loads(tenant.features_enabled) if tenant.features_enabled else []
-        )
-        for tenant in tenants
-    ]
+    return ORJSONResponse([_tenant_to_dict(tenant) for tenant in tenants])
 
 @router.get("/{tenant_id}", response_model=TenantResponse)
-async def get_tenant(
+def get_tenant(
     tenant_id: str,
     db: Session = Depends(get_db)
 ):
     """Get tenant by ID"""
-    tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+    tenant = db.get(Tenant, tenant_id)
     if not tenant:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Tenant not found"
         )
     
-    return TenantResponse(
-        id=tenant.id,
-        name=tenant.name,
-        domain=tenant.domain,
-        api_key=tenant.api_key,
-        created_at=tenant.created_at.isoformat(),
-        updated_at=tenant.updated_at.isoformat(),
-        is_active=tenant.is_active,
-        max_documents=tenant.max_documents,
-        max_chat_messages=tenant.max_chat_messages,
-        max_storage_mb=tenant.max_storage_mb,
-        features_enabled=json.loads(tenant.features_enabled) if tenant.features_enabled else []
-    )
+    return ORJSONResponse(_tenant_to_dict(tenant))
 
 @router.put("/{tenant_id}", response_model=TenantResponse)
-async def update_tenant(
+def update_tenant(
     tenant_id: str,
     tenant_data: TenantUpdate,
     db: Session = Depends(get_db)
@@ -188,22 +176,10 @@ async def update_tenant(
             detail="Tenant not found"
         )
     
-    return TenantResponse(
-        id=tenant.id,
-        name=tenant.name,
-        domain=tenant.domain,
-        api_key=tenant.api_key,
-        created_at=tenant.created_at.isoformat(),
-        updated_at=tenant.updated_at.isoformat(),
-        is_active=tenant.is_active,
-        max_documents=tenant.max_documents,
-        max_chat_messages=tenant.max_chat_messages,
-        max_storage_mb=tenant.max_storage_mb,
-        features_enabled=json.loads(tenant.features_enabled) if tenant.features_enabled else []
-    )
+    return ORJSONResponse(_tenant_to_dict(tenant))
 
 @router.post("/{tenant_id}/regenerate-api-key")
-async def regenerate_api_key(
+def regenerate_api_key(
     tenant_id: str,
     db: Session = Depends(get_db)
 ):
@@ -216,10 +192,10 @@ async def regenerate_api_key(
             detail="Tenant not found"
         )
     
-    return {"new_api_key": new_api_key}
+    return ORJSONResponse({"new_api_key": new_api_key})
 
 @router.get("/{tenant_id}/usage", response_model=TenantUsageResponse)
-async def get_tenant_usage(
+def get_tenant_usage(
     tenant_id: str,
     db: Session = Depends(get_db)
 ):
@@ -232,84 +208,78 @@ async def get_tenant_usage(
             detail="Tenant not found"
         )
     
-    return TenantUsageResponse(**usage)
+    return ORJSONResponse(usage)
 
 @router.delete("/{tenant_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_tenant(
+def delete_tenant(
     tenant_id: str,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Delete a tenant and all associated data"""
-    success = TenantProvisioning.delete_tenant(db, tenant_id)
+    success = TenantProvisioning.delete_tenant(db, tenant_id, cleanup_directories=False)
     
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Tenant not found"
         )
+    
+    # Remove the tenant's uploads and vector database after responding
+    background_tasks.add_task(TenantProvisioning.cleanup_tenant_directories, tenant_id)
 
 @router.get("/test-debug")
-async def test_debug(
+def test_debug(
     request: Request,
     db: Session = Depends(get_db)
 ):
-    """Debug endpoint to test tenant context - UPDATED"""
-    """Debug endpoint to test tenant context"""
+    """Debug endpoint to test tenant context (only available in debug mode)"""
+    if not settings.debug:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not found"
+        )
+    
     try:
-        print(f"DEBUG: test-debug called")
-        
-        # Simple test: get all tenants
-        all_tenants = db.query(Tenant).all()
-        print(f"DEBUG: All tenants in DB: {len(all_tenants)}")
-        
         # Try to find tenant by API key from Authorization header
         auth_header = request.headers.get("authorization")
         if auth_header and auth_header.startswith("Bearer "):
             api_key = auth_header[7:]  # Remove "Bearer " prefix
-            print(f"DEBUG: Looking for API key: {api_key[:20]}...")
             
             tenant = db.query(Tenant).filter(Tenant.api_key == api_key, Tenant.is_active == True).first()
             if tenant:
-                print(f"DEBUG: Found tenant: {tenant.name}")
+                logger.debug(f"test-debug found tenant by API key: {tenant.name}")
                 return {"tenant_id": tenant.id, "tenant_name": tenant.name}
-            else:
-                print(f"DEBUG: No tenant found for API key")
+            logger.debug("test-debug found no tenant for API key")
         
         # Try query parameter identification
         tenant_id = request.query_params.get("tenant_id")
         if tenant_id:
             tenant = db.query(Tenant).filter(Tenant.id == tenant_id, Tenant.is_active == True).first()
             if tenant:
-                print(f"DEBUG: Found tenant by query param: {tenant.name}")
-                return {"tenant_id": tenant.id, "tenant_name": tenant.name}
-        
-        # Try development mode identification
-        if request.headers.get("x-development-mode") == "true":
-            tenant = db.query(Tenant).filter(Tenant.name == "Default Tenant").first()
-            if tenant:
-                print(f"DEBUG: Using default tenant (dev mode): {tenant.name}")
+                logger.debug(f"test-debug found tenant by query param: {tenant.name}")
                 return {"tenant_id": tenant.id, "tenant_name": tenant.name}
         
-        # Fallback to default tenant
+        # Fall back to the default tenant (also used in development mode)
         default_tenant = db.query(Tenant).filter(Tenant.name == "Default Tenant").first()
         if default_tenant:
-            print(f"DEBUG: Using default tenant: {default_tenant.name}")
+            logger.debug(f"test-debug using default tenant: {default_tenant.name}")
             return {"tenant_id": default_tenant.id, "tenant_name": default_tenant.name}
         
         # Last resort: any tenant
         any_tenant = db.query(Tenant).first()
         if any_tenant:
-            print(f"DEBUG: Using any tenant: {any_tenant.name}")
+            logger.debug(f"test-debug using any tenant: {any_tenant.name}")
             return {"tenant_id": any_tenant.id, "tenant_name": any_tenant.name}
         
         return {"error": "No tenants found in database"}
         
     except Exception as e:
-        print(f"DEBUG: Exception in test_debug: {str(e)}")
+        logger.error(f"test-debug failed: {str(e)}")
         return {"error": str(e)}
 
 @router.get("/current/usage", response_model=TenantUsageResponse)
-async def get_current_tenant_usage(
+def get_current_tenant_usage(
     tenant_context: TenantContext = Depends(get_tenant_context),
     db: Session = Depends(get_db)
 ):
@@ -322,4 +292,4 @@ async def get_current_tenant_usage(
             detail="Tenant not found"
         )
     
-    return TenantUsageResponse(**usage) 
\ No newline at end of file
+    return ORJSONResponse(usage) 
\ No newline at end of file
@@ -0,0 +1,251 @@
+"""
+Response Caches for Doc Query
+
+Caches RAG responses keyed by query embedding so that repeated or
+paraphrased questions can be answered without retrieval or an LLM call,
+plus exact-match caches for responses and query embeddings.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """
+    Bounded exact-match cache that evicts the least recently used entry
+
+    Used from both the event loop and worker threads (embedding, indexing),
+    so every operation holds a lock.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        """
+        Initialize LRU cache
+
+        Args:
+            max_entries: Maximum number of cached entries
+        """
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get a cached value, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Cache a value, evicting the oldest entry if full"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        """Drop a cached entry, if present"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear_matching(self, predicate: Callable[[Hashable], bool]):
+        """Drop the cached entries whose keys match a predicate"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+
+class SemanticCache:
+    """
+    In-memory cache of responses looked up by cosine similarity
+
+    Candidates are found with random-projection LSH: each embedding is
+    hashed into one bucket per table by the signs of its projections, and
+    only entries sharing a bucket with the query are compared exactly.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl_seconds: int = 300,
+        max_entries: int = 1024,
+        num_tables: int = 8,
+        num_bits: int = 16
+    ):
+        """
+        Initialize semantic cache
+
+        Args:
+            threshold: Minimum cosine similarity for a cache hit
+            ttl_seconds: Time an entry stays valid after it is inserted
+            max_entries: Maximum entries kept per namespace (oldest are evicted)
+            num_tables: Number of LSH hash tables
+            num_bits: Number of projection bits per table
+        """
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self._namespaces: Dict[str, Dict] = {}
+        self._projections: Dict[int, np.ndarray] = {}
+        self._bit_weights = (1 << np.arange(num_bits, dtype=np.uint64)).astype(np.uint64)
+        self._next_id = 0
+        # Lookups run on the event loop while invalidation runs in worker threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """Convert an embedding to a unit-length float32 vector"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _hash(self, vector: np.ndarray) -> List[int]:
+        """Compute the bucket key of a vector in each hash table"""
+        dimension = vector.shape[0]
+        projection = self._projections.get(dimension)
+        if projection is None:
+            rng = np.random.default_rng(dimension)
+            projection = rng.standard_normal((dimension, self.num_tables * self.num_bits)).astype(np.float32)
+            self._projections[dimension] = projection
+
+        bits = (vector @ projection > 0).reshape(self.num_tables, self.num_bits)
+        return [int(key) for key in bits.astype(np.uint64) @ self._bit_weights]
+
+    def _remove(self, namespace: Dict, entry_id: int):
+        """Remove an entry and its bucket references"""
+        entry = namespace['entries'].pop(entry_id)
+        for table, key in zip(namespace['tables'], entry['keys']):
+            bucket = table[key]
+            bucket.discard(entry_id)
+            if not bucket:
+                del table[key]
+
+    def _evict_expired(self, namespace: Dict, now: float):
+        """Drop entries whose TTL has passed"""
+        # Entries are kept in insertion order with a fixed TTL, so expired
+        # entries are always at the front
+        entries = namespace['entries']
+        while entries:
+            entry_id, entry = next(iter(entries.items()))
+            if entry['expires_at'] > now:
+                break
+            self._remove(namespace, entry_id)
+
+    def lookup(self, namespace: str, embedding: List[float]) -> Optional[Dict]:
+        """
+        Find a cached value for a similar query
+
+        Args:
+            namespace: Cache partition (e.g. tenant)
+            embedding: Query embedding
+
+        Returns:
+            Cached value if a similar enough query is cached, None otherwise
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            partition = self._namespaces.get(namespace)
+            if not partition:
+                return None
+
+            now = time.monotonic()
+            self._evict_expired(partition, now)
+
+            candidate_ids = set()
+            for table, key in zip(partition['tables'], self._hash(vector)):
+                candidate_ids.update(table.get(key, ()))
+            if not candidate_ids:
+                return None
+
+            entries = partition['entries']
+            candidate_ids = [entry_id for entry_id in candidate_ids if entries[entry_id]['expires_at'] > now]
+            if not candidate_ids:
+                return None
+
+            matrix = np.stack([entries[entry_id]['embedding'] for entry_id in candidate_ids])
+            scores = matrix @ vector
+
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            # Hits don't extend the TTL, so a popular answer is still refreshed
+            # once it expires
+            logger.debug(f"Semantic cache hit in {namespace} (score {scores[best]:.3f})")
+            return entries[candidate_ids[best]]['value']
+
+    def clear_prefix(self, prefix: str):
+        """Drop every namespace whose name starts with a prefix"""
+        with self._lock:
+            for namespace in [name for name in self._namespaces if name.startswith(prefix)]:
+                del self._namespaces[namespace]
+
+    def insert(self, namespace: str, embedding: List[float], value: Dict):
+        """
+        Cache a value for a query embedding
+
+        Args:
+            namespace: Cache partition (e.g. tenant)
+            embedding: Query embedding
+            value: Value to return on future hits
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            partition = self._namespaces.setdefault(namespace, {
+                'entries': OrderedDict(),
+                'tables': [{} for _ in range(self.num_tables)]
+            })
+
+            keys = self._hash(vector)
+            entry_id = self._next_id
+            self._next_id += 1
+
+            partition['entries'][entry_id] = {
+                'embedding': vector,
+                'keys': keys,
+                'value': value,
+                'expires_at': time.monotonic() + self.ttl_seconds
+            }
+            for table, key in zip(partition['tables'], keys):
+                table.setdefault(key, set()).add(entry_id)
+
+            while len(partition['entries']) > self.max_entries:
+                self._remove(partition, next(iter(partition['entries'])))
+
+# Shared caches for RAG responses, query embeddings, search results, and
+# the chunks of recently analyzed documents
+semantic_cache = SemanticCache()
+exact_response_cache = LRUCache(max_entries=1024)
+query_embedding_cache = LRUCache(max_entries=1024)
+search_result_cache = LRUCache(max_entries=512)
+document_chunks_cache = LRUCache(max_entries=64)
+
+def tenant_cache_prefix(tenant_id: Optional[str]) -> str:
+    """Prefix of the response cache namespaces belonging to a tenant"""
+    return f"{tenant_id or 'default'}:"
+
+def clear_tenant_caches(tenant_id: Optional[str]):
+    """Drop a tenant's cached responses, searches and chunks (after its documents change)"""
+    prefix = tenant_cache_prefix(tenant_id)
+    semantic_cache.clear_prefix(prefix)
+
+    def matches_tenant(key) -> bool:
+        # Keys of the exact-match caches start with the tenant's namespace
+        return key[0].startswith(prefix)
+
+    exact_response_cache.clear_matching(matches_tenant)
+    search_result_cache.clear_matching(matches_tenant)
+    document_chunks_cache.clear_matching(matches_tenant)
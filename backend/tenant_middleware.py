@@ -1,10 +1,10 @@
 from fastapi import Request, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select, and_, or_
 from sqlalchemy.orm import Session
 from database import get_db, Tenant
-from typing import Optional
-import json
-import re
+from typing import Dict, FrozenSet, Optional, Tuple
+import time
 
 # Security scheme for API key authentication
 security = HTTPBearer(auto_error=False)
@@ -14,7 +14,46 @@ class TenantContext:
     def __init__(self, tenant: Tenant):
         self.tenant = tenant
         self.tenant_id = tenant.id
-        self.features = json.loads(tenant.features_enabled) if tenant.features_enabled else ["basic"]
+        self.features: FrozenSet[str] = frozenset(tenant.features_enabled or ["basic"])
+    
+    def has(self, feature: str) -> bool:
+        """Check whether a feature is enabled for the tenant"""
+        return feature in self.features
+
+# Resolved tenants are reused for a minute, keyed by API key or, for requests
+# without one, by the subdomain/query/path candidates (all None resolves to
+# the default tenant, which is what the frontend sends)
+TENANT_CACHE_TTL_SECONDS = 60
+TENANT_CACHE_MAX_SIZE = 10_000
+_api_key_cache: Dict[str, Tuple[float, TenantContext]] = {}
+_tenant_id_cache: Dict[Tuple[Optional[str], ...], Tuple[float, TenantContext]] = {}
+
+def invalidate_api_key(api_key: Optional[str]):
+    """Drop the cached tenant for an API key"""
+    if api_key:
+        _api_key_cache.pop(api_key, None)
+
+def invalidate_tenant_ids():
+    """Drop tenants cached by ID (after tenants are created, changed or deleted)"""
+    _tenant_id_cache.clear()
+
+def _get_cached(cache: Dict, key) -> Optional[TenantContext]:
+    """Get an unexpired tenant from a cache"""
+    cached = cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+def _cache_tenant(cache: Dict, key, db: Session, tenant: Tenant) -> TenantContext:
+    """Cache a resolved tenant and return its context"""
+    # Detach so the cached tenant outlives this request's session
+    db.expunge(tenant)
+    tenant_context = TenantContext(tenant)
+    if len(cache) >= TENANT_CACHE_MAX_SIZE:
+        # Evict the oldest entry
+        cache.pop(next(iter(cache)), None)
+    cache[key] = (time.monotonic() + TENANT_CACHE_TTL_SECONDS, tenant_context)
+    return tenant_context
 
 class TenantMiddleware:
     """Middleware for tenant identification and isolation"""
@@ -34,9 +73,9 @@ class TenantMiddleware:
             return None
         
         # Extract subdomain (e.g., tenant1.localhost:8000 -> tenant1)
-        subdomain_match = re.match(r"^([^.]+)\.", host)
-        if subdomain_match:
-            return subdomain_match.group(1)
+        dot = host.find(".")
+        if dot > 0:
+            return host[:dot]
         return None
     
     @staticmethod
@@ -57,75 +96,83 @@ class TenantMiddleware:
     ) -> TenantContext:
         """Identify tenant using multiple strategies"""
         
-        # Strategy 1: API Key in Authorization header
-        tenant_id = await TenantMiddleware.get_tenant_from_header(request, credentials)
-        print(f"DEBUG: API key from header: {tenant_id}")
-        if tenant_id:
-            # Debug: Check all tenants in database
-            all_tenants = db.query(Tenant).all()
-            print(f"DEBUG: All tenants in DB: {[(t.id, t.name, t.api_key[:20] + '...' if t.api_key else 'None') for t in all_tenants]}")
-            
-            tenant = db.query(Tenant).filter(Tenant.api_key == tenant_id, Tenant.is_active == True).first()
-            print(f"DEBUG: Tenant found by API key: {tenant.name if tenant else 'None'}")
-            if tenant:
-                return TenantContext(tenant)
+        api_key = await TenantMiddleware.get_tenant_from_header(request, credentials)
+        if api_key:
+            cached = _get_cached(_api_key_cache, api_key)
+            if cached:
+                return cached
+        
+        # Gather every candidate up front and look them all up in one query
+        candidate_ids = (
+            await TenantMiddleware.get_tenant_from_subdomain(request),   # Strategy 2: Subdomain
+            await TenantMiddleware.get_tenant_from_query_param(request), # Strategy 3: Query parameter
+            await TenantMiddleware.get_tenant_from_path_param(request)   # Strategy 4: Path parameter
+        )
+        if not api_key:
+            cached = _get_cached(_tenant_id_cache, candidate_ids)
+            if cached:
+                return cached
+        lookup_ids = {tenant_id for tenant_id in candidate_ids if tenant_id}
         
-        # Strategy 2: Subdomain
-        tenant_id = await TenantMiddleware.get_tenant_from_subdomain(request)
-        if tenant_id:
-            tenant = db.query(Tenant).filter(Tenant.id == tenant_id, Tenant.is_active == True).first()
-            if tenant:
-                return TenantContext(tenant)
+        conditions = [Tenant.name == "Default Tenant", Tenant.id == "default"]
+        if api_key:
+            conditions.append(and_(Tenant.api_key == api_key, Tenant.is_active == True))
+        if lookup_ids:
+            conditions.append(and_(Tenant.id.in_(lookup_ids), Tenant.is_active == True))
+        matches = db.execute(select(Tenant).where(or_(*conditions))).scalars().all()
         
-        # Strategy 3: Query parameter
-        tenant_id = await TenantMiddleware.get_tenant_from_query_param(request)
-        if tenant_id:
-            tenant = db.query(Tenant).filter(Tenant.id == tenant_id, Tenant.is_active == True).first()
-            if tenant:
-                return TenantContext(tenant)
+        # Strategy 1: API Key in Authorization header
+        if api_key:
+            for tenant in matches:
+                if tenant.api_key == api_key and tenant.is_active:
+                    return _cache_tenant(_api_key_cache, api_key, db, tenant)
         
-        # Strategy 4: Path parameter
-        tenant_id = await TenantMiddleware.get_tenant_from_path_param(request)
-        if tenant_id:
-            tenant = db.query(Tenant).filter(Tenant.id == tenant_id, Tenant.is_active == True).first()
-            if tenant:
-                return TenantContext(tenant)
+        # Strategies 2-4: Tenant ID from subdomain, query or path parameter
+        active_by_id = {tenant.id: tenant for tenant in matches if tenant.is_active}
+        for tenant_id in candidate_ids:
+            if tenant_id in active_by_id:
+                return TenantMiddleware._resolved(db, api_key, candidate_ids, active_by_id[tenant_id])
         
-        # Strategy 5: Default tenant (for development/testing)
-        if request.headers.get("x-development-mode") == "true":
-            tenant = db.query(Tenant).filter(Tenant.name == "Default Tenant").first()
-            if tenant:
-                return TenantContext(tenant)
+        # Strategy 5: Default tenant (for development/testing and as the fallback)
+        tenant = next((t for t in matches if t.name == "Default Tenant"), None)
+        if tenant:
+            return TenantMiddleware._resolved(db, api_key, candidate_ids, tenant)
         
-        # Create default tenant if none exists
-        tenant = db.query(Tenant).filter(Tenant.name == "Default Tenant").first()
-        if not tenant:
-            # Check if a tenant with id "default" already exists
-            existing_default = db.query(Tenant).filter(Tenant.id == "default").first()
-            if existing_default:
-                tenant = existing_default
-            else:
-                # If still no tenant, try to get any tenant
-                tenant = db.query(Tenant).first()
-                if not tenant:
-                    # Create a new default tenant
-                    tenant = Tenant(
-                        id="default",
-                        name="Default Tenant",
-                        features_enabled=json.dumps(["basic", "chat", "documents"])
-                    )
-                    db.add(tenant)
-                    try:
-                        db.commit()
-                        db.refresh(tenant)
-                    except Exception as e:
-                        db.rollback()
-                        # If commit fails, try to get any tenant again
-                        tenant = db.query(Tenant).first()
-                        if not tenant:
-                            raise Exception("No tenant available and cannot create default tenant")
+        # Create default tenant if none exists, reusing a tenant with id "default"
+        existing_default = next((t for t in matches if t.id == "default"), None)
+        if existing_default:
+            tenant = existing_default
+        else:
+            # If still no tenant, try to get any tenant
+            tenant = db.query(Tenant).first()
+            if not tenant:
+                # Create a new default tenant
+                tenant = Tenant(
+                    id="default",
+                    name="Default Tenant",
+                    features_enabled=["basic", "chat", "documents"]
+                )
+                db.add(tenant)
+                try:
+                    db.commit()
+                    db.refresh(tenant)
+                except Exception as e:
+                    db.rollback()
+                    # If commit fails, try to get any tenant again
+                    tenant = db.query(Tenant).first()
+                    if not tenant:
+                        raise Exception("No tenant available and cannot create default tenant")
         
-        return TenantContext(tenant)
+        return TenantMiddleware._resolved(db, api_key, candidate_ids, tenant)
+    
+    @staticmethod
+    def _resolved(db: Session, api_key: Optional[str], candidate_ids: Tuple[Optional[str], ...], tenant: Tenant) -> TenantContext:
+        """Build the context for a tenant resolved without its API key, caching it by candidate IDs"""
+        if api_key:
+            # An unknown API key falls through to here; don't cache by IDs so
+            # the key is checked again once it becomes valid
+            return TenantContext(tenant)
+        return _cache_tenant(_tenant_id_cache, candidate_ids, db, tenant)
 
 # Dependency for getting tenant context
 async def get_tenant_context(
@@ -134,7 +181,12 @@ async def get_tenant_context(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ) -> TenantContext:
     """Dependency to get tenant context for any endpoint"""
-    return await TenantMiddleware.identify_tenant(request, db, credentials)
+    # Resolve once per request; later lookups read it back from request state
+    tenant_context = getattr(request.state, "tenant", None)
+    if tenant_context is None:
+        tenant_context = await TenantMiddleware.identify_tenant(request, db, credentials)
+        request.state.tenant = tenant_context
+    return tenant_context
 
 # Dependency for getting tenant ID only
 async def get_tenant_id(tenant_context: TenantContext = Depends(get_tenant_context)) -> str:
@@ -1,11 +1,28 @@
+from sqlalchemy import delete, select, func
 from sqlalchemy.orm import Session
-from database import Tenant, engine, Base
-from typing import Optional, Dict, Any
-import json
+from database import Tenant, Document, ChatMessage, engine, Base
+from tenant_middleware import invalidate_api_key, invalidate_tenant_ids
+from typing import Optional, Dict, Any, Tuple
+import secrets
 import uuid
 import os
+import time
 from config import settings
 
+# Usage counts for limit checks are reused for a few seconds per tenant and resource
+USAGE_CACHE_TTL_SECONDS = 5
+_usage_cache: Dict[Tuple[str, str], Tuple[float, float, int]] = {}
+
+# Rough storage estimate per document (would need actual file sizes)
+STORAGE_MB_PER_DOCUMENT = 0.1
+
+# Limited resources: the model whose rows are counted and the tenant's limit attribute
+_LIMITED_RESOURCES = {
+    "documents": (Document, "max_documents"),
+    "chat_messages": (ChatMessage, "max_chat_messages"),
+    "storage": (Document, "max_storage_mb")
+}
+
 class TenantProvisioning:
     """System for provisioning and managing tenants"""
     
@@ -27,7 +44,7 @@ class TenantProvisioning:
         
         # Generate API key if not provided
         if not api_key:
-            api_key = f"sk_{uuid.uuid4().hex[:32]}"
+            api_key = f"sk_{secrets.token_hex(16)}"
         
         # Set default features if not provided
         if features_enabled is None:
@@ -42,13 +59,16 @@ class TenantProvisioning:
             max_documents=max_documents,
             max_chat_messages=max_chat_messages,
             max_storage_mb=max_storage_mb,
-            features_enabled=json.dumps(features_enabled)
+            features_enabled=features_enabled
         )
         
         db.add(tenant)
         db.commit()
         db.refresh(tenant)
         
+        # A tenant ID that fell back to the default tenant now resolves to this one
+        invalidate_tenant_ids()
+        
         # Create tenant-specific directories
         TenantProvisioning._create_tenant_directories(tenant_id)
         
@@ -70,7 +90,7 @@ class TenantProvisioning:
         **kwargs
     ) -> Optional[Tenant]:
         """Update tenant configuration"""
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+        tenant = db.get(Tenant, tenant_id)
         if not tenant:
             return None
         
@@ -82,23 +102,32 @@ class TenantProvisioning:
         
         for field, value in kwargs.items():
             if field in allowed_fields:
-                if field == 'features_enabled' and isinstance(value, list):
-                    setattr(tenant, field, json.dumps(value))
-                else:
-                    setattr(tenant, field, value)
+                setattr(tenant, field, value)
         
         db.commit()
         db.refresh(tenant)
+        
+        # Limits, features or active status may have changed
+        TenantProvisioning.invalidate_usage_cache(tenant_id)
+        invalidate_api_key(tenant.api_key)
+        invalidate_tenant_ids()
         return tenant
     
+    @staticmethod
+    def invalidate_usage_cache(tenant_id: str):
+        """Drop the cached usage counts for a tenant"""
+        for resource_type in _LIMITED_RESOURCES:
+            _usage_cache.pop((tenant_id, resource_type), None)
+    
     @staticmethod
     def regenerate_api_key(db: Session, tenant_id: str) -> Optional[str]:
         """Regenerate API key for a tenant"""
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+        tenant = db.get(Tenant, tenant_id)
         if not tenant:
             return None
         
-        new_api_key = f"sk_{uuid.uuid4().hex[:32]}"
+        new_api_key = f"sk_{secrets.token_hex(16)}"
+        invalidate_api_key(tenant.api_key)
         tenant.api_key = new_api_key
         db.commit()
         
@@ -107,23 +136,23 @@ class TenantProvisioning:
     @staticmethod
     def get_tenant_usage(db: Session, tenant_id: str) -> Dict[str, Any]:
         """Get current usage statistics for a tenant"""
-        from database import Document, ChatMessage, ChatSession
+        from database import ChatSession
         
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+        tenant = db.get(Tenant, tenant_id)
         if not tenant:
             return {}
         
-        # Count documents
-        doc_count = db.query(Document).filter(Document.tenant_id == tenant_id).count()
-        
-        # Count chat messages
-        message_count = db.query(ChatMessage).filter(ChatMessage.tenant_id == tenant_id).count()
-        
-        # Count chat sessions
-        session_count = db.query(ChatSession).filter(ChatSession.tenant_id == tenant_id).count()
+        # Count documents, chat messages and chat sessions in one round-trip
+        doc_count, message_count, session_count = db.execute(
+            select(
+                select(func.count()).select_from(Document).where(Document.tenant_id == tenant_id).scalar_subquery(),
+                select(func.count()).select_from(ChatMessage).where(ChatMessage.tenant_id == tenant_id).scalar_subquery(),
+                select(func.count()).select_from(ChatSession).where(ChatSession.tenant_id == tenant_id).scalar_subquery()
+            )
+        ).one()
         
         # Calculate storage usage (simplified - would need actual file size calculation)
-        storage_usage_mb = doc_count * 0.1  # Rough estimate
+        storage_usage_mb = doc_count * STORAGE_MB_PER_DOCUMENT
         
         return {
             "tenant_id": tenant_id,
@@ -139,64 +168,103 @@ class TenantProvisioning:
                 "chat_sessions": session_count,
                 "storage_mb": storage_usage_mb
             },
-            "features_enabled": json.loads(tenant.features_enabled) if tenant.features_enabled else []
+            "features_enabled": tenant.features_enabled
         }
     
     @staticmethod
-    def check_tenant_limits(db: Session, tenant_id: str, resource_type: str, amount: int = 1) -> bool:
-        """Check if tenant has capacity for the requested resource"""
-        usage = TenantProvisioning.get_tenant_usage(db, tenant_id)
+    def check_tenant_limits(db: Session, tenant: Tenant, resource_type: str, amount: int = 1) -> bool:
+        """Check if tenant has capacity for the requested resource (tenant as already loaded for the request)"""
+        if resource_type not in _LIMITED_RESOURCES:
+            return True
+        
+        key = (tenant.id, resource_type)
+        cached = _usage_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            expires_at, used, limit = cached
+        else:
+            # Count only the resource being checked; the limit comes from the loaded tenant
+            model, limit_attribute = _LIMITED_RESOURCES[resource_type]
+            used = db.execute(
+                select(func.count()).select_from(model).where(model.tenant_id == tenant.id)
+            ).scalar_one()
+            limit = getattr(tenant, limit_attribute)
+            if resource_type == "storage":
+                used *= STORAGE_MB_PER_DOCUMENT
+            expires_at = time.monotonic() + USAGE_CACHE_TTL_SECONDS
         
-        if resource_type == "documents":
-            return usage["usage"]["documents"] + amount <= usage["limits"]["max_documents"]
-        elif resource_type == "chat_messages":
-            return usage["usage"]["chat_messages"] + amount <= usage["limits"]["max_chat_messages"]
-        elif resource_type == "storage":
-            return usage["usage"]["storage_mb"] + amount <= usage["limits"]["max_storage_mb"]
+        if used + amount > limit:
+            _usage_cache[key] = (expires_at, used, limit)
+            return False
         
+        # Count the resource about to be created so the cached count stays current
+        if resource_type != "storage":
+            used += amount
+        _usage_cache[key] = (expires_at, used, limit)
         return True
     
     @staticmethod
-    def list_tenants(db: Session, active_only: bool = True) -> list[Tenant]:
-        """List all tenants"""
-        query = db.query(Tenant)
+    def list_tenants(
+        db: Session,
+        active_only: bool = True,
+        last_id: Optional[str] = None,
+        limit: int = 100
+    ) -> list:
+        """List tenants as column rows, ordered by ID, starting after last_id"""
+        query = select(
+            Tenant.id, Tenant.name, Tenant.domain, Tenant.api_key,
+            Tenant.created_at, Tenant.updated_at, Tenant.is_active,
+            Tenant.max_documents, Tenant.max_chat_messages, Tenant.max_storage_mb,
+            Tenant.features_enabled
+        )
         if active_only:
-            query = query.filter(Tenant.is_active == True)
-        return query.all()
+            query = query.where(Tenant.is_active == True)
+        if last_id is not None:
+            query = query.where(Tenant.id > last_id)
+        return db.execute(query.order_by(Tenant.id).limit(limit)).all()
     
     @staticmethod
-    def delete_tenant(db: Session, tenant_id: str) -> bool:
-        """Delete a tenant and all associated data"""
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+    def delete_tenant(db: Session, tenant_id: str, cleanup_directories: bool = True) -> bool:
+        """
+        Delete a tenant and all associated data
+        
+        Pass cleanup_directories=False to remove the tenant's files separately
+        with cleanup_tenant_directories (e.g. after the response is sent).
+        """
+        tenant = db.get(Tenant, tenant_id)
         if not tenant:
             return False
         
-        # Delete associated data
-        from database import Document, ChatMessage, ChatSession
+        # Delete associated data with bulk statements, without syncing the session
+        from database import DocumentChunk, ChatSession
+        from vector_store import release_vector_store
         
-        db.query(Document).filter(Document.tenant_id == tenant_id).delete()
-        db.query(ChatMessage).filter(ChatMessage.tenant_id == tenant_id).delete()
-        db.query(ChatSession).filter(ChatSession.tenant_id == tenant_id).delete()
+        for model in (DocumentChunk, Document, ChatMessage, ChatSession):
+            db.execute(delete(model).where(model.tenant_id == tenant_id), execution_options={"synchronize_session": False})
         
-        # Delete tenant
-        db.delete(tenant)
+        # Delete tenant (a bulk delete skips loading its relationships)
+        api_key = tenant.api_key
+        db.execute(delete(Tenant).where(Tenant.id == tenant_id), execution_options={"synchronize_session": False})
+        db.expunge(tenant)
         db.commit()
+        TenantProvisioning.invalidate_usage_cache(tenant_id)
+        invalidate_api_key(api_key)
+        invalidate_tenant_ids()
         
         # Clean up directories
-        TenantProvisioning._cleanup_tenant_directories(tenant_id)
+        release_vector_store(tenant_id)
+        if cleanup_directories:
+            TenantProvisioning.cleanup_tenant_directories(tenant_id)
         
         return True
     
     @staticmethod
-    def _cleanup_tenant_directories(tenant_id: str):
+    def cleanup_tenant_directories(tenant_id: str):
         """Clean up tenant-specific directories"""
         import shutil
         
         tenant_upload_dir = os.path.join(settings.upload_dir, tenant_id)
         tenant_chroma_dir = os.path.join(settings.chroma_db_path, tenant_id)
         
-        if os.path.exists(tenant_upload_dir):
-            shutil.rmtree(tenant_upload_dir)
-        
-        if os.path.exists(tenant_chroma_dir):
-            shutil.rmtree(tenant_chroma_dir) 
\ No newline at end of file
+        # Missing directories are fine; no separate existence check needed
+        shutil.rmtree(tenant_upload_dir, ignore_errors=True)
+        shutil.rmtree(tenant_chroma_dir, ignore_errors=True) 
\ No newline at end of file
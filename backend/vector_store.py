@@ -7,15 +7,91 @@ and vector similarity search functionality.
 
 import os
 import logging
-from typing import List, Dict, Optional, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterator, List, Dict, Optional, Tuple
 from datetime import datetime
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 import openai
+import tiktoken
 from config import settings
+from semantic_cache import query_embedding_cache, clear_tenant_caches
 
 logger = logging.getLogger(__name__)
 
+# Chunks embedded and added to ChromaDB per request when indexing
+INDEX_BATCH_SIZE = 256
+
+# Chunks read back from ChromaDB per request when listing a document's chunks
+DOCUMENT_CHUNKS_PAGE_SIZE = 1000
+
+# Embedding model and the per-request input limits (the API caps a request
+# at 300k tokens; the token budget leaves some headroom). Inputs are split
+# into small requests that are sent concurrently.
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_BATCH_MAX_ITEMS = 64
+EMBEDDING_BATCH_MAX_TOKENS = 250_000
+EMBEDDING_CONCURRENCY = 4
+
+# Longest single input the embedding model accepts, in tokens
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+# Settings for newly created collections. OpenAI embeddings are unit length,
+# so inner product ranks like cosine without normalizing on every comparison.
+# Documents are indexed once and searched often, so the graph is built denser
+# than ChromaDB's defaults for better recall at a modest search effort.
+COLLECTION_METADATA = {
+    "description": "Document embeddings for Doc Query",
+    "hnsw:space": "ip",
+    "hnsw:M": settings.hnsw_m,
+    "hnsw:construction_ef": settings.hnsw_ef_construction,
+    "hnsw:search_ef": settings.hnsw_ef_search
+}
+
+# Shared threads for concurrent embedding requests, bounding in-flight calls
+_embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY, thread_name_prefix="embeddings")
+
+@lru_cache(maxsize=1)
+def _embedding_encoding() -> tiktoken.Encoding:
+    """Get the embedding model's tokenizer, loaded on first use"""
+    return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+def query_cache_key(query: str) -> str:
+    """Key for cached query embeddings (whitespace-normalized query text)"""
+    return " ".join(query.split())
+
+def _embedding_batches(texts: List[str]) -> List[List[str]]:
+    """
+    Split texts into consecutive batches within the embeddings request limits
+
+    Texts longer than the model's input limit are truncated here rather than
+    being rejected by the API after a round trip.
+    """
+    encoding = _embedding_encoding()
+    
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for text, tokens in zip(texts, encoding.encode_batch(texts)):
+        text_tokens = len(tokens)
+        if text_tokens > EMBEDDING_MAX_INPUT_TOKENS:
+            logger.warning(f"Truncating embedding input from {text_tokens} to {EMBEDDING_MAX_INPUT_TOKENS} tokens")
+            text = encoding.decode(tokens[:EMBEDDING_MAX_INPUT_TOKENS])
+            text_tokens = EMBEDDING_MAX_INPUT_TOKENS
+        
+        if batch and (len(batch) >= EMBEDDING_BATCH_MAX_ITEMS or batch_tokens + text_tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += text_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
 class VectorStore:
     """ChromaDB vector store with OpenAI embeddings"""
     
@@ -74,7 +150,7 @@ class VectorStore:
             except Exception:
                 self.collection = self.client.create_collection(
                     name=self.collection_name,
-                    metadata={"description": "Document embeddings for Doc Query"}
+                    metadata=COLLECTION_METADATA
                 )
                 logger.info(f"Created new collection: {self.collection_name}")
                 
@@ -96,20 +172,41 @@ class VectorStore:
             raise ValueError("OpenAI client not initialized. Check API key configuration.")
         
         try:
-            # Use OpenAI embeddings API
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=texts
-            )
+            # Use OpenAI embeddings API, sending sub-batches concurrently
+            batches = _embedding_batches(texts)
+            if len(batches) == 1:
+                return self._embed_batch(batches[0])
             
-            # Extract embeddings
-            embeddings = [embedding.embedding for embedding in response.data]
+            embeddings = []
+            for batch_embeddings in _embedding_executor.map(self._embed_batch, batches):
+                embeddings.extend(batch_embeddings)
             return embeddings
             
         except Exception as e:
             logger.error(f"Failed to generate embeddings: {str(e)}")
             raise
     
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a search query, reusing the embedding for repeated query text"""
+        key = query_cache_key(query)
+        embedding = query_embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.generate_embeddings([query])[0]
+            query_embedding_cache.set(key, embedding)
+        return embedding
+    
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts that fit in a single embeddings request"""
+        # Optionally request shortened embeddings; smaller vectors shrink the
+        # HNSW index and make searches cheaper
+        options = {"dimensions": settings.embedding_dimensions} if settings.embedding_dimensions else {}
+        response = self.openai_client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts,
+            **options
+        )
+        return [embedding.embedding for embedding in response.data]
+    
     def index_document(self, document_id: int, chunks: List[Dict], metadata: Dict) -> bool:
         """
         Index document chunks in vector database
@@ -127,37 +224,54 @@ class VectorStore:
                 logger.warning(f"No chunks to index for document {document_id}")
                 return False
             
-            # Extract text content from chunks
-            texts = [chunk['content'] for chunk in chunks]
-            
-            # Generate embeddings
-            embeddings = self.generate_embeddings(texts)
-            
-            # Prepare IDs and metadata for ChromaDB
-            ids = [f"doc_{document_id}_chunk_{chunk['id']}" for chunk in chunks]
+            # Metadata shared by every chunk of the document
+            indexed_at = datetime.utcnow().isoformat()
+            total_chunks = len(chunks)
+            filename = metadata.get('filename', '')
+            file_type = metadata.get('file_type', '')
+            title = metadata.get('title', '')
+            id_prefix = f"doc_{document_id}_chunk_"
+            added_ids = []
             
-            # Enhanced metadata for each chunk
-            chunk_metadata = []
-            for chunk in chunks:
-                chunk_meta = {
-                    'document_id': document_id,
-                    'chunk_id': chunk['id'],
-                    'chunk_size': chunk['metadata']['chunk_size'],
-                    'filename': metadata.get('filename', ''),
-                    'file_type': metadata.get('file_type', ''),
-                    'title': metadata.get('title', ''),
-                    'total_chunks': len(chunks),
-                    'indexed_at': datetime.utcnow().isoformat()
-                }
-                chunk_metadata.append(chunk_meta)
+            # Embed and store in batches so large documents stay within the
+            # embeddings request limits and memory stays flat
+            for start in range(0, len(chunks), INDEX_BATCH_SIZE):
+                batch = chunks[start:start + INDEX_BATCH_SIZE]
+                
+                # Build the parallel lists ChromaDB expects in one pass
+                texts, ids, chunk_metadata = [], [], []
+                for chunk in batch:
+                    chunk_id = chunk['id']
+                    texts.append(chunk['content'])
+                    ids.append(id_prefix + str(chunk_id))
+                    chunk_metadata.append({
+                        'document_id': document_id,
+                        'chunk_id': chunk_id,
+                        'chunk_size': chunk['metadata']['chunk_size'],
+                        'filename': filename,
+                        'file_type': file_type,
+                        'title': title,
+                        'total_chunks': total_chunks,
+                        'indexed_at': indexed_at
+                    })
+                
+                try:
+                    # Add to ChromaDB collection
+                    self.collection.add(
+                        embeddings=self.generate_embeddings(texts),
+                        documents=texts,
+                        metadatas=chunk_metadata,
+                        ids=ids
+                    )
+                except Exception:
+                    # Don't leave a partially indexed document behind
+                    if added_ids:
+                        self.collection.delete(ids=added_ids)
+                    raise
+                added_ids.extend(ids)
             
-            # Add to ChromaDB collection
-            self.collection.add(
-                embeddings=embeddings,
-                documents=texts,
-                metadatas=chunk_metadata,
-                ids=ids
-            )
+            # Cached search results, chunks and answers may now be out of date
+            clear_tenant_caches(self.tenant_id)
             
             logger.info(f"Successfully indexed {len(chunks)} chunks for document {document_id}")
             return True
@@ -166,7 +280,13 @@ class VectorStore:
             logger.error(f"Failed to index document {document_id}: {str(e)}")
             return False
     
-    def search_similar(self, query: str, n_results: int = 5, filter_metadata: Optional[Dict] = None) -> List[Dict]:
+    def search_similar(
+        self,
+        query: str,
+        n_results: int = 5,
+        filter_metadata: Optional[Dict] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict]:
         """
         Search for similar documents using vector similarity
         
@@ -174,13 +294,15 @@ class VectorStore:
             query: Search query text
             n_results: Number of results to return
             filter_metadata: Optional metadata filters
+            query_embedding: Precomputed embedding for the query (optional)
             
         Returns:
             List of similar documents with scores and metadata
         """
         try:
-            # Generate embedding for query
-            query_embedding = self.generate_embeddings([query])[0]
+            # Embed the query unless the caller already has an embedding
+            if query_embedding is None:
+                query_embedding = self.embed_query(query)
             
             # Prepare where clause for filtering
             where_clause = None
@@ -200,20 +322,22 @@ class VectorStore:
             # Format results
             formatted_results = []
             if results['documents'] and results['documents'][0]:
-                for i, (doc, metadata, distance) in enumerate(zip(
-                    results['documents'][0],
-                    results['metadatas'][0],
-                    results['distances'][0]
-                )):
-                    # Convert distance to similarity score (1 - distance)
-                    similarity_score = 1 - distance
-                    
+                documents = results['documents'][0]
+                metadatas = results['metadatas'][0]
+                
+                # Convert distances to similarity scores (1 - distance) in one
+                # array operation and rank by descending similarity
+                distances = np.asarray(results['distances'][0], dtype=np.float64)
+                order = np.argsort(distances, kind='stable')
+                scores = (1.0 - distances).tolist()
+                
+                for rank, i in enumerate(order.tolist(), start=1):
                     formatted_results.append({
-                        'rank': i + 1,
-                        'content': doc,
-                        'metadata': metadata,
-                        'similarity_score': similarity_score,
-                        'distance': distance
+                        'rank': rank,
+                        'content': documents[i],
+                        'metadata': metadatas[i],
+                        'similarity_score': scores[i],
+                        'distance': results['distances'][0][i]
                     })
             
             return formatted_results
@@ -222,33 +346,61 @@ class VectorStore:
             logger.error(f"Failed to search similar documents: {str(e)}")
             return []
     
-    def get_document_chunks(self, document_id: int) -> List[Dict]:
+    def iter_document_chunks(self, document_id: int, page_size: int = DOCUMENT_CHUNKS_PAGE_SIZE) -> Iterator[Dict]:
         """
-        Get all chunks for a specific document
+        Iterate over a document's chunks in chunk order, a page at a time
+        
+        Chunk IDs are numbered 0..total_chunks-1, so each page fetches the next
+        window of IDs; only one page is held in memory at a time.
         
         Args:
             document_id: Database document ID
+            page_size: Chunks fetched from ChromaDB per request
             
-        Returns:
-            List of document chunks with metadata
+        Yields:
+            Document chunks with metadata
         """
-        try:
+        start = 0
+        total_chunks = None
+        while total_chunks is None or start < total_chunks:
             results = self.collection.get(
-                where={'document_id': document_id},
+                where={'$and': [
+                    {'document_id': document_id},
+                    {'chunk_id': {'$gte': start}},
+                    {'chunk_id': {'$lt': start + page_size}}
+                ]},
                 include=['documents', 'metadatas']
             )
+            if not results['documents']:
+                return
             
-            chunks = []
-            for i, (doc, metadata) in enumerate(zip(results['documents'], results['metadatas'])):
-                chunks.append({
+            page = [
+                {
                     'chunk_id': metadata['chunk_id'],
                     'content': doc,
                     'metadata': metadata
-                })
+                }
+                for doc, metadata in zip(results['documents'], results['metadatas'])
+            ]
+            page.sort(key=lambda x: x['chunk_id'])
+            yield from page
             
-            # Sort by chunk_id
-            chunks.sort(key=lambda x: x['chunk_id'])
-            return chunks
+            if total_chunks is None:
+                total_chunks = page[0]['metadata'].get('total_chunks', 0)
+            start += page_size
+    
+    def get_document_chunks(self, document_id: int) -> List[Dict]:
+        """
+        Get all chunks for a specific document
+        
+        Args:
+            document_id: Database document ID
+            
+        Returns:
+            List of document chunks with metadata, in chunk order
+        """
+        try:
+            return list(self.iter_document_chunks(document_id))
             
         except Exception as e:
             logger.error(f"Failed to get chunks for document {document_id}: {str(e)}")
@@ -265,20 +417,11 @@ class VectorStore:
             True if deletion successful, False otherwise
         """
         try:
-            # Get all IDs for the document
-            results = self.collection.get(
-                where={'document_id': document_id},
-                include=['ids']
-            )
-            
-            if results['ids']:
-                # Delete all chunks for the document
-                self.collection.delete(ids=results['ids'])
-                logger.info(f"Deleted {len(results['ids'])} chunks for document {document_id}")
-                return True
-            else:
-                logger.warning(f"No chunks found for document {document_id}")
-                return False
+            # Delete all chunks for the document by filter, without fetching their IDs first
+            self.collection.delete(where={'document_id': document_id})
+            clear_tenant_caches(self.tenant_id)
+            logger.info(f"Deleted chunks for document {document_id}")
+            return True
                 
         except Exception as e:
             logger.error(f"Failed to delete document {document_id}: {str(e)}")
@@ -294,15 +437,13 @@ class VectorStore:
         try:
             count = self.collection.count()
             
-            # Get unique document IDs
-            results = self.collection.get(include=['metadatas'])
-            unique_docs = set()
-            for metadata in results['metadatas']:
-                unique_docs.add(metadata['document_id'])
+            # Count documents by their first chunk (chunk IDs start at 0 for every
+            # document), fetching IDs only instead of every chunk's metadata
+            first_chunks = self.collection.get(where={'chunk_id': 0}, include=[])
             
             return {
                 'total_chunks': count,
-                'unique_documents': len(unique_docs),
+                'unique_documents': len(first_chunks['ids']),
                 'collection_name': self.collection_name,
                 'last_updated': datetime.utcnow().isoformat()
             }
@@ -322,11 +463,31 @@ class VectorStore:
             self.client.delete_collection(name=self.collection_name)
             self.collection = self.client.create_collection(
                 name=self.collection_name,
-                metadata={"description": "Document embeddings for Doc Query"}
+                metadata=COLLECTION_METADATA
             )
+            clear_tenant_caches(self.tenant_id)
             logger.info(f"Reset collection: {self.collection_name}")
             return True
             
         except Exception as e:
             logger.error(f"Failed to reset collection: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
+
+# Vector stores shared across requests, one per tenant
+_vector_stores: Dict[Optional[str], VectorStore] = {}
+_vector_stores_lock = threading.Lock()
+
+def get_vector_store(tenant_id: Optional[str] = None) -> VectorStore:
+    """Get the shared vector store for a tenant, creating it on first use"""
+    vector_store = _vector_stores.get(tenant_id)
+    if vector_store is None:
+        with _vector_stores_lock:
+            vector_store = _vector_stores.get(tenant_id)
+            if vector_store is None:
+                vector_store = VectorStore(tenant_id=tenant_id)
+                _vector_stores[tenant_id] = vector_store
+    return vector_store
+
+def release_vector_store(tenant_id: Optional[str]):
+    """Drop the shared vector store for a tenant (e.g. after its data is deleted)"""
+    _vector_stores.pop(tenant_id, None)
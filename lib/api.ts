@@ -46,8 +46,8 @@ class ApiService {
   }
 
   // Document management
-  async getDocuments(): Promise<ApiResponse<{ documents: any[], total: number }>> {
-    return this.request('/documents/')
+  async getDocuments(lastId?: number): Promise<ApiResponse<{ documents: any[], next_cursor: number | null }>> {
+    return this.request(lastId === undefined ? '/documents/' : `/documents/?last_id=${lastId}`)
   }
 
   async uploadDocument(file: File): Promise<ApiResponse<any>> {
@@ -87,6 +87,10 @@ class ApiService {
     return this.request(`/documents/${id}/process`, { method: 'POST' })
   }
 
+  async getDocumentProcessStatus(id: number): Promise<ApiResponse<{ document_id: number, status: string, error: string | null }>> {
+    return this.request(`/documents/${id}/process/status`)
+  }
+
   async getDocumentChunks(id: number): Promise<ApiResponse<any[]>> {
     return this.request(`/documents/${id}/chunks`)
   }